@@ -1,8 +1,16 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, send_file, flash
-import sqlite3, hashlib, os, json
+import time
+IMPORT_STARTED = time.perf_counter()      # ver STARTUP en create_app()
+
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, send_file, flash, g, has_app_context, \
+    has_request_context, make_response, Response, stream_with_context, \
+    before_render_template, template_rendered
+import sqlite3, hashlib, os, sys, json, threading, atexit, bisect, math, queue, itertools, gzip
+from collections import OrderedDict, deque
 from datetime import datetime
 from functools import wraps
+from contextlib import contextmanager
 import io
+import click
 
 app = Flask(__name__)
 app.secret_key = 'arena_ranking_secret_2024_xK9mP2'
@@ -15,20 +23,289 @@ def ensure_db():
     if not os.path.exists(DB_PATH):
         if os.path.exists(PREFAB_PATH):
             import shutil
+            migrate_db(PREFAB_PATH)
             shutil.copy(PREFAB_PATH, DB_PATH)
             print(f'[DB] Copiada desde {PREFAB_PATH}')
         else:
             init_db_fresh()
             print('[DB] Creada desde cero')
+    migrate_db(DB_PATH)
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
+# ─── DB: pool de conexiones por worker/hilo ───────────────────────────────────
+# Cada hilo de cada worker mantiene UNA conexión abierta y la reutiliza entre
+# requests. Los PRAGMAs se aplican una sola vez al abrirla y sqlite3 guarda
+# los statements preparados en su caché (cached_statements).
+
+DB_PRAGMAS = (
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",   # ~16 MB por conexión
+    "PRAGMA temp_store = MEMORY",
+)
+DB_STATEMENT_CACHE = 256
+
+_pool = threading.local()
+_pool_lock = threading.Lock()
+POOL_STATS = {'hits': 0, 'misses': 0, 'opened': 0, 'closed': 0}
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor que anota cada sentencia (y su fetch) en las métricas del request."""
+
+    def execute(self, sql, parameters=()):
+        self._sql, start = sql, time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._elapsed = time.perf_counter() - start
+            record_sql(sql, self._elapsed)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._sql, start = sql, time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._elapsed = time.perf_counter() - start
+            record_sql(sql, self._elapsed)
+
+    def _timed_fetch(self, fetch, *args):
+        start = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            self._elapsed = getattr(self, '_elapsed', 0) + elapsed
+            record_sql(getattr(self, '_sql', ''), elapsed, fetch=self._elapsed)
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, size or self.arraysize)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+class PooledConnection(sqlite3.Connection):
+    """Conexión reutilizable: close() la devuelve al pool en vez de cerrarla."""
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def execute(self, sql, parameters=()):
+        return self.cursor(TimedCursor).execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor(TimedCursor).executemany(sql, seq_of_parameters)
+
+    def really_close(self):
+        super().close()
+
+def _pool_count(key):
+    with _pool_lock:
+        POOL_STATS[key] += 1
+
+def _open_connection():
+    conn = sqlite3.connect(DB_PATH, factory=PooledConnection,
+                           cached_statements=DB_STATEMENT_CACHE)
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON")
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
+    _pool_count('opened')
+    return conn
+
+def _pooled_connection():
+    conn = getattr(_pool, 'conn', None)
+    # Tras un fork (gunicorn --preload) o un cambio de DB_PATH no se reutiliza
+    if conn is not None and (_pool.pid != os.getpid() or _pool.path != DB_PATH):
+        if _pool.pid == os.getpid():
+            conn.really_close()
+            _pool_count('closed')
+        conn = None
+    if conn is None:
+        _pool_count('misses')
+        conn = _open_connection()
+        _pool.conn, _pool.pid, _pool.path = conn, os.getpid(), DB_PATH
+    else:
+        _pool_count('hits')
     return conn
 
-def init_db_fresh():
-    conn = sqlite3.connect(DB_PATH)
+def get_db():
+    if has_app_context():
+        if 'db' not in g:
+            g.db = _pooled_connection()
+        return g.db
+    return _pooled_connection()
+
+@app.teardown_appcontext
+def release_db(exc):
+    conn = g.pop('db', None)
+    if conn is not None:
+        conn.close()
+    snapshot = g.pop('read_db', None)
+    if snapshot is not None:
+        snapshot.really_close()
+
+def close_db_pool():
+    """Cierra la conexión del hilo actual (al apagar el worker)."""
+    conn = getattr(_pool, 'conn', None)
+    if conn is not None and _pool.pid == os.getpid():
+        conn.really_close()
+        _pool_count('closed')
+    _pool.conn = None
+
+atexit.register(close_db_pool)
+
+def pool_stats():
+    with _pool_lock:
+        stats = dict(POOL_STATS)
+    total = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = round(stats['hits'] / total, 4) if total else 0.0
+    stats['pid'] = os.getpid()
+    return stats
+
+# ─── MÉTRICAS: SQL Y LATENCIA POR REQUEST ─────────────────────────────────────
+# Cada request lleva en g.metrics el nº de sentencias, el tiempo total en SQL,
+# la sentencia más lenta y el tiempo de render de plantillas (señales de Flask).
+# Al terminar se vuelca en histogramas por endpoint (por worker) que se exponen
+# en /admin/metrics con formato de texto de Prometheus. Las sentencias que
+# superan SLOW_QUERY_MS se imprimen en el log.
+
+SLOW_QUERY_MS    = float(os.environ.get('SLOW_QUERY_MS', 200))
+LATENCY_BUCKETS  = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERY_BUCKETS    = (1, 2, 5, 10, 20, 50, 100, 250, 1000)
+
+# En el hilo del escritor no hay contexto de request: cada job anota sus
+# sentencias en su propio dict y submit() lo suma al g.metrics del llamador.
+_job_metrics = threading.local()
+
+def new_sql_metrics(endpoint=None):
+    return {'queries': 0, 'sql_time': 0.0, 'slowest': (0.0, None), 'endpoint': endpoint}
+
+def merge_sql_metrics(m, other):
+    m['queries']  += other['queries']
+    m['sql_time'] += other['sql_time']
+    if other['slowest'][0] > m['slowest'][0]:
+        m['slowest'] = other['slowest']
+
+def record_sql(sql, elapsed, fetch=None):
+    """Anota una sentencia (fetch=None) o el tiempo de su fetch (fetch = acumulado)."""
+    m = getattr(_job_metrics, 'current', None)
+    if m is None and has_app_context():
+        m = g.get('metrics')
+    total = elapsed if fetch is None else fetch
+    if total * 1000 >= SLOW_QUERY_MS and (fetch is None or total - elapsed < SLOW_QUERY_MS / 1000):
+        where = (m or {}).get('endpoint') or (request.endpoint if has_request_context() else '-')
+        print(f"[SLOW SQL] {total * 1000:.1f} ms ({where}): {' '.join(sql.split())[:300]}")
+    if m is None:
+        return
+    if fetch is None:
+        m['queries'] += 1
+    m['sql_time'] += elapsed
+    if total > m['slowest'][0]:
+        m['slowest'] = (total, sql)
+
+class Histogram:
+    def __init__(self, buckets, label='endpoint'):
+        self.buckets = buckets
+        self.label   = label
+        self.series  = {}      # label -> [contadores por bucket..., +Inf, suma]
+
+    def observe(self, label, value):
+        s = self.series.get(label)
+        if s is None:
+            s = self.series[label] = [0] * (len(self.buckets) + 2)
+        s[bisect.bisect_left(self.buckets, value)] += 1
+        s[-1] += value
+
+    def render(self, name, help_text):
+        lines = [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for label, s in sorted(self.series.items()):
+            acc = 0
+            for le, n in zip(self.buckets + ('+Inf',), s[:-1]):
+                acc += n
+                lines.append(f'{name}_bucket{{{self.label}="{label}",le="{le}"}} {acc}')
+            lines.append(f'{name}_sum{{{self.label}="{label}"}} {s[-1]:.6f}')
+            lines.append(f'{name}_count{{{self.label}="{label}"}} {acc}')
+        return lines
+
+METRICS_LOCK = threading.Lock()
+METRICS = {
+    'arena_request_duration_seconds': (Histogram(LATENCY_BUCKETS), 'Tiempo total del handler por endpoint.'),
+    'arena_request_sql_seconds':      (Histogram(LATENCY_BUCKETS), 'Tiempo en SQLite por request.'),
+    'arena_request_render_seconds':   (Histogram(LATENCY_BUCKETS), 'Tiempo de render de plantillas por request.'),
+    'arena_request_queries':          (Histogram(QUERY_BUCKETS),   'Sentencias SQL por request.'),
+}
+SLOWEST_SQL = {}       # endpoint -> (segundos, sql) peor sentencia vista
+
+@app.before_request
+def start_request_metrics():
+    g.metrics = dict(new_sql_metrics(), start=time.perf_counter(), render_time=0.0)
+
+def _render_started(sender, template, context, **extra):
+    m = g.get('metrics')
+    if m is not None:
+        m['render_start'] = time.perf_counter()
+
+def _render_finished(sender, template, context, **extra):
+    m = g.get('metrics')
+    if m is not None and 'render_start' in m:
+        m['render_time'] += time.perf_counter() - m.pop('render_start')
+
+before_render_template.connect(_render_started, app)
+template_rendered.connect(_render_finished, app)
+
+@app.after_request
+def finish_request_metrics(response):
+    m = g.pop('metrics', None)
+    if m is None:
+        return response
+    total = time.perf_counter() - m['start']
+    endpoint = request.endpoint or 'unknown'
+    with METRICS_LOCK:
+        for name, value in (('arena_request_duration_seconds', total),
+                            ('arena_request_sql_seconds', m['sql_time']),
+                            ('arena_request_render_seconds', m['render_time']),
+                            ('arena_request_queries', m['queries'])):
+            METRICS[name][0].observe(endpoint, value)
+        if m['slowest'][1] and m['slowest'][0] > SLOWEST_SQL.get(endpoint, (0,))[0]:
+            SLOWEST_SQL[endpoint] = m['slowest']
+        if STARTUP['first_request_ms'] is None:
+            STARTUP['first_request_ms'] = round(total * 1000, 2)
+            STARTUP['first_request_endpoint'] = endpoint
+    response.headers['Server-Timing'] = (
+        f"sql;dur={m['sql_time'] * 1000:.2f};desc=\"{m['queries']} q\", "
+        f"tpl;dur={m['render_time'] * 1000:.2f}, "
+        f"app;dur={(total - m['sql_time'] - m['render_time']) * 1000:.2f}"
+    )
+    return response
+
+def metrics_text():
+    lines = []
+    with METRICS_LOCK:
+        for name, (hist, help_text) in METRICS.items():
+            lines += hist.render(name, help_text)
+        lines += ['# HELP arena_slowest_query_seconds Sentencia más lenta vista por endpoint.',
+                  '# TYPE arena_slowest_query_seconds gauge']
+        for endpoint, (secs, sql) in sorted(SLOWEST_SQL.items()):
+            stmt = ' '.join(sql.split())[:120].replace('\\', '\\\\').replace('"', '\\"')
+            lines.append(f'arena_slowest_query_seconds{{endpoint="{endpoint}",sql="{stmt}"}} {secs:.6f}')
+    pool = pool_stats()
+    lines += ['# TYPE arena_db_pool_hits counter', f"arena_db_pool_hits {pool['hits']}",
+              '# TYPE arena_db_pool_misses counter', f"arena_db_pool_misses {pool['misses']}"]
+    lines += ['# HELP arena_startup_seconds Costo del arranque de este proceso por fase.',
+              '# TYPE arena_startup_seconds gauge']
+    for phase in ('import', 'db', 'warm', 'first_request'):
+        if STARTUP[f'{phase}_ms'] is not None:
+            lines.append(f'arena_startup_seconds{{phase="{phase}"}} {STARTUP[f"{phase}_ms"] / 1000:.6f}')
+    if READ_SNAPSHOT:
+        lines += SNAPSHOT.metric_lines()
+    return '\n'.join(lines) + '\n'
+
+def init_db_fresh(path=None):
+    conn = sqlite3.connect(path or DB_PATH)
     c = conn.cursor()
     now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
@@ -93,6 +370,396 @@ def init_db_fresh():
     conn.commit()
     conn.close()
 
+# ─── MIGRACIONES ──────────────────────────────────────────────────────────────
+# La versión del esquema se guarda en PRAGMA user_version. Cada migración corre
+# una sola vez, dentro de su propia transacción, y sube la versión al terminar.
+
+def _table_columns(conn, table):
+    return {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+
+def _m001_users_bio(conn):
+    # Las bases prefabricadas se crearon sin la columna bio que usa /profile/edit
+    if 'bio' not in _table_columns(conn, 'users'):
+        conn.execute('ALTER TABLE users ADD COLUMN bio TEXT DEFAULT ""')
+
+def _m002_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_point_logs_user_added ON point_logs(user_id, added_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_point_logs_added ON point_logs(added_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_season_date ON events(season, event_date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_date ON events(event_date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_total ON users(total_points DESC)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_season ON users(season_points DESC)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_nick_lower ON users(LOWER(minecraft_nick))")
+    # Un jugador recibe puntos una sola vez por evento. Si una base vieja ya
+    # tiene duplicados se deja un índice normal para no perder datos.
+    dups = conn.execute(
+        "SELECT 1 FROM point_logs WHERE event_id IS NOT NULL GROUP BY user_id, event_id HAVING COUNT(*) > 1 LIMIT 1"
+    ).fetchone()
+    if dups:
+        print('[DB] point_logs tiene duplicados (user_id, event_id); índice no único')
+        conn.execute("CREATE INDEX IF NOT EXISTS ux_point_logs_user_event ON point_logs(user_id, event_id)")
+    else:
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_point_logs_user_event ON point_logs(user_id, event_id)")
+
+def _m003_app_state(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS app_state (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    conn.execute("INSERT OR IGNORE INTO app_state (key, value) VALUES ('data_gen', 0)")
+
+def _m004_data_mtime(conn):
+    conn.execute("INSERT OR IGNORE INTO app_state (key, value) VALUES ('data_mtime', CAST(strftime('%s','now') AS INTEGER))")
+
+def _m005_bulk_requests(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS bulk_requests (
+        idem_key TEXT PRIMARY KEY,
+        event_id INTEGER,
+        response TEXT NOT NULL,
+        created_by TEXT,
+        created_at TEXT
+    )''')
+
+def _m006_ocr_jobs(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS ocr_jobs (
+        id TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        result TEXT,
+        created_by TEXT,
+        created_at TEXT,
+        updated_at TEXT
+    )''')
+
+def _m007_season_standings(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS season_standings (
+        season_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        username TEXT,
+        discord TEXT,
+        minecraft_nick TEXT,
+        season_points INTEGER NOT NULL,
+        total_points INTEGER,
+        PRIMARY KEY (season_id, position)
+    ) WITHOUT ROWID''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_season_standings_user ON season_standings(user_id, season_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_point_logs_event ON point_logs(event_id)")
+
+def _m008_reconcile(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS reconcile_ledger (
+        user_id INTEGER PRIMARY KEY,
+        total_points INTEGER NOT NULL,
+        season_points INTEGER NOT NULL
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS point_log_tombstones (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        log_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        event_id INTEGER,
+        points INTEGER NOT NULL,
+        added_at TEXT
+    )''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_point_logs_tombstone AFTER DELETE ON point_logs
+        BEGIN
+            INSERT INTO point_log_tombstones (log_id, user_id, event_id, points, added_at)
+            VALUES (OLD.id, OLD.user_id, OLD.event_id, OLD.points, OLD.added_at);
+        END''')
+
+def _m009_users_fts(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_username_lower ON users(LOWER(username))")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_discord_lower ON users(LOWER(discord))")
+    try:
+        conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+            username, minecraft_nick, discord,
+            content='users', content_rowid='id', tokenize='trigram'
+        )''')
+    except sqlite3.OperationalError as e:
+        # SQLite sin FTS5/trigram: la búsqueda sigue funcionando con LIKE
+        print(f'[DB] FTS5 trigram no disponible ({e}); búsqueda con LIKE')
+        return
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_users_fts_ai AFTER INSERT ON users BEGIN
+            INSERT INTO users_fts (rowid, username, minecraft_nick, discord)
+            VALUES (NEW.id, NEW.username, NEW.minecraft_nick, NEW.discord);
+        END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_users_fts_ad AFTER DELETE ON users BEGIN
+            INSERT INTO users_fts (users_fts, rowid, username, minecraft_nick, discord)
+            VALUES ('delete', OLD.id, OLD.username, OLD.minecraft_nick, OLD.discord);
+        END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_users_fts_au AFTER UPDATE OF username, minecraft_nick, discord ON users BEGIN
+            INSERT INTO users_fts (users_fts, rowid, username, minecraft_nick, discord)
+            VALUES ('delete', OLD.id, OLD.username, OLD.minecraft_nick, OLD.discord);
+            INSERT INTO users_fts (rowid, username, minecraft_nick, discord)
+            VALUES (NEW.id, NEW.username, NEW.minecraft_nick, NEW.discord);
+        END''')
+    conn.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+
+def _m010_point_deltas(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS point_deltas (
+        gen INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        old_total INTEGER,
+        new_total INTEGER
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_point_deltas_gen ON point_deltas(gen)")
+
+# Temporada de una fila de point_logs ({r} = alias, NEW u OLD): la de su evento
+# o, si no tiene evento, la que estaba activa cuando se cargó (empezó antes de
+# added_at y no había terminado). Es la misma regla con la que los ajustes
+# manuales suman a users.season_points; la usan las clasificaciones guardadas,
+# stats, rollups y la conciliación.
+SEASON_OF_LOG = (
+    "CASE WHEN {r}.event_id IS NOT NULL THEN (SELECT season FROM events WHERE id = {r}.event_id) "
+    "ELSE (SELECT id FROM seasons WHERE start_date <= {r}.added_at "
+    "AND (end_date > {r}.added_at OR (end_date IS NULL AND is_active = 1)) "
+    "ORDER BY start_date DESC, id DESC LIMIT 1) END"
+)
+
+def _stats_log_triggers():
+    """Triggers de point_logs sobre stats; 'season_points:<id>' sigue SEASON_OF_LOG."""
+    def season_add(sign, row):
+        return f'''
+            INSERT INTO stats (key, value)
+            SELECT 'season_points:' || s, {sign}{row}.points FROM (SELECT {SEASON_OF_LOG.format(r=row)} AS s) WHERE s IS NOT NULL
+            ON CONFLICT(key) DO UPDATE SET value = value + excluded.value;'''
+
+    return {
+        'trg_stats_logs_ai': f'''AFTER INSERT ON point_logs BEGIN
+            UPDATE stats SET value = value + 1 WHERE key = 'point_logs';
+            UPDATE stats SET value = value + NEW.points WHERE key = 'points';{season_add('', 'NEW')}
+        END''',
+        'trg_stats_logs_ad': f'''AFTER DELETE ON point_logs BEGIN
+            UPDATE stats SET value = value - 1 WHERE key = 'point_logs';
+            UPDATE stats SET value = value - OLD.points WHERE key = 'points';{season_add('-', 'OLD')}
+        END''',
+        'trg_stats_logs_au': f'''AFTER UPDATE OF points, event_id, added_at ON point_logs BEGIN
+            UPDATE stats SET value = value - OLD.points + NEW.points WHERE key = 'points';{season_add('-', 'OLD')}{season_add('', 'NEW')}
+        END''',
+    }
+
+def _m011_stats(conn):
+    """Contadores globales y por temporada mantenidos por triggers."""
+    conn.execute('''CREATE TABLE IF NOT EXISTS stats (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID''')
+
+    triggers = {
+        'trg_stats_users_ai':  "AFTER INSERT ON users BEGIN UPDATE stats SET value = value + 1 WHERE key = 'users'; END",
+        'trg_stats_users_ad':  "AFTER DELETE ON users BEGIN UPDATE stats SET value = value - 1 WHERE key = 'users'; END",
+        'trg_stats_events_ai': "AFTER INSERT ON events BEGIN UPDATE stats SET value = value + 1 WHERE key = 'events'; END",
+        'trg_stats_events_ad': "AFTER DELETE ON events BEGIN UPDATE stats SET value = value - 1 WHERE key = 'events'; END",
+        **_stats_log_triggers(),
+        # Un evento que cambia de temporada se lleva sus puntos
+        'trg_stats_events_au': '''AFTER UPDATE OF season ON events BEGIN
+            UPDATE stats SET value = value - (SELECT COALESCE(SUM(points), 0) FROM point_logs WHERE event_id = NEW.id)
+            WHERE key = 'season_points:' || OLD.season;
+            INSERT INTO stats (key, value)
+            SELECT 'season_points:' || NEW.season, COALESCE(SUM(points), 0) FROM point_logs WHERE event_id = NEW.id
+            ON CONFLICT(key) DO UPDATE SET value = value + excluded.value;
+        END''',
+    }
+    for name, body in triggers.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+    conn.execute("DELETE FROM stats")
+    conn.execute('''INSERT INTO stats (key, value)
+        SELECT 'users', COUNT(*) FROM users
+        UNION ALL SELECT 'events', COUNT(*) FROM events
+        UNION ALL SELECT 'point_logs', COUNT(*) FROM point_logs
+        UNION ALL SELECT 'points', COALESCE(SUM(points), 0) FROM point_logs
+        UNION ALL SELECT 'season_points:' || e.season, SUM(pl.points)
+                  FROM point_logs pl JOIN events e ON e.id = pl.event_id GROUP BY e.season''')
+
+def _m012_scoring_scales(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS scoring_scales (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE NOT NULL,
+        points TEXT NOT NULL,
+        created_by TEXT,
+        created_at TEXT
+    )''')
+    for table in ('events', 'seasons'):
+        if 'scale_id' not in _table_columns(conn, table):
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN scale_id INTEGER REFERENCES scoring_scales(id)")
+
+def _m013_import_jobs(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS import_jobs (
+        id TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        event_id INTEGER,
+        filename TEXT,
+        processed_rows INTEGER DEFAULT 0,
+        result TEXT,
+        created_by TEXT,
+        created_at TEXT,
+        updated_at TEXT
+    )''')
+
+def _m014_nick_gen(conn):
+    conn.execute("INSERT OR IGNORE INTO app_state (key, value) VALUES ('nick_gen', 0)")
+    bump = "UPDATE app_state SET value = value + 1 WHERE key = 'nick_gen';"
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_nick_gen_ai AFTER INSERT ON users BEGIN {bump} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_nick_gen_ad AFTER DELETE ON users BEGIN {bump} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_nick_gen_au AFTER UPDATE OF minecraft_nick ON users BEGIN {bump} END")
+
+def _m015_rank_history(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS rank_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        event_id INTEGER,
+        total_points INTEGER NOT NULL,
+        rank INTEGER NOT NULL,
+        recorded_at TEXT NOT NULL
+    )''')
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_rank_history_user_event ON rank_history(user_id, event_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_rank_history_user ON rank_history(user_id, id)")
+    # Si se quitan los puntos de un evento, el punto de la serie deja de existir
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_rank_history_log_ad AFTER DELETE ON point_logs
+        WHEN OLD.event_id IS NOT NULL BEGIN
+            DELETE FROM rank_history WHERE user_id = OLD.user_id AND event_id = OLD.event_id;
+        END''')
+
+# Cubetas de los rollups: expresión SQL sobre una fila de point_logs ({r} = NEW/OLD).
+# Van como TEXT, igual que rollups.bucket: comparar la columna con un entero
+# obliga a SQLite a comparar numéricamente y deja de usar la clave primaria.
+ROLLUP_BUCKETS = {
+    'event':  "CAST({r}.event_id AS TEXT)",
+    'month':  "substr({r}.added_at, 1, 7)",
+    'season': "CAST((" + SEASON_OF_LOG + ") AS TEXT)",
+}
+
+def _rollup_triggers():
+    def rollup_add(sign, row):
+        selects = ' UNION ALL '.join(
+            f"SELECT '{dim}', b, {row}.user_id, {sign}{row}.points, {sign}1 FROM (SELECT {expr.format(r=row)} AS b) WHERE b IS NOT NULL"
+            for dim, expr in ROLLUP_BUCKETS.items())
+        return f'''
+            INSERT INTO rollups (dim, bucket, user_id, points, entries) {selects}
+            ON CONFLICT(dim, bucket, user_id) DO UPDATE SET points = points + excluded.points, entries = entries + excluded.entries;'''
+
+    def rollup_remove(row):
+        deletes = ''.join(
+            f"\n            DELETE FROM rollups WHERE dim = '{dim}' AND bucket = {expr.format(r=row)} "
+            f"AND user_id = {row}.user_id AND entries = 0;"
+            for dim, expr in ROLLUP_BUCKETS.items())
+        return rollup_add('-', row) + deletes
+
+    return {
+        'trg_rollups_logs_ai': f"AFTER INSERT ON point_logs BEGIN{rollup_add('', 'NEW')}\n        END",
+        'trg_rollups_logs_ad': f"AFTER DELETE ON point_logs BEGIN{rollup_remove('OLD')}\n        END",
+        'trg_rollups_logs_au': f'''AFTER UPDATE OF user_id, event_id, points, added_at ON point_logs BEGIN{rollup_remove('OLD')}{rollup_add('', 'NEW')}
+        END''',
+        # Un evento que cambia de temporada se lleva sus puntos
+        'trg_rollups_events_au': '''AFTER UPDATE OF season ON events BEGIN
+            UPDATE rollups SET points = rollups.points - agg.points, entries = rollups.entries - agg.entries
+            FROM (SELECT user_id, SUM(points) AS points, COUNT(*) AS entries FROM point_logs
+                  WHERE event_id = NEW.id GROUP BY user_id) AS agg
+            WHERE rollups.dim = 'season' AND rollups.bucket = CAST(OLD.season AS TEXT) AND rollups.user_id = agg.user_id;
+            DELETE FROM rollups WHERE dim = 'season' AND bucket = CAST(OLD.season AS TEXT) AND entries = 0;
+            INSERT INTO rollups (dim, bucket, user_id, points, entries)
+            SELECT 'season', CAST(NEW.season AS TEXT), user_id, SUM(points), COUNT(*) FROM point_logs WHERE event_id = NEW.id GROUP BY user_id
+            ON CONFLICT(dim, bucket, user_id) DO UPDATE SET points = points + excluded.points, entries = entries + excluded.entries;
+        END''',
+    }
+
+def _m016_rollups(conn):
+    """Puntos por jugador y cubeta (evento, mes, temporada) mantenidos por triggers."""
+    conn.execute('''CREATE TABLE IF NOT EXISTS rollups (
+        dim TEXT NOT NULL,
+        bucket TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        points INTEGER NOT NULL DEFAULT 0,
+        entries INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (dim, bucket, user_id)
+    ) WITHOUT ROWID''')
+    # Cubre la tabla de posiciones de una cubeta: rango del índice, sin tocar la tabla
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_rollups_rank ON rollups(dim, bucket, points DESC, user_id, entries)")
+    triggers = _rollup_triggers()
+    for name, body in triggers.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+    conn.execute("DELETE FROM rollups")
+    conn.execute('''INSERT INTO rollups (dim, bucket, user_id, points, entries)
+        SELECT 'event', event_id, user_id, SUM(points), COUNT(*) FROM point_logs
+            WHERE event_id IS NOT NULL GROUP BY event_id, user_id
+        UNION ALL SELECT 'month', substr(added_at, 1, 7), user_id, SUM(points), COUNT(*) FROM point_logs
+            WHERE added_at IS NOT NULL GROUP BY substr(added_at, 1, 7), user_id
+        UNION ALL SELECT 'season', e.season, pl.user_id, SUM(pl.points), COUNT(*)
+            FROM point_logs pl JOIN events e ON e.id = pl.event_id WHERE e.season IS NOT NULL GROUP BY e.season, pl.user_id''')
+
+def _m017_rollup_text_buckets(conn):
+    # Las bases migradas con la versión anterior de _m016 comparaban bucket con enteros
+    for name, body in _rollup_triggers().items():
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(f"CREATE TRIGGER {name} {body}")
+
+def _m018_season_stats(conn):
+    # season_points:<id> pasa a seguir SEASON_OF_LOG: también cuenta los ajustes sin evento
+    for name, body in _stats_log_triggers().items():
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(f"CREATE TRIGGER {name} {body}")
+    conn.execute("DELETE FROM stats WHERE key LIKE 'season_points:%'")
+    conn.execute(f'''INSERT INTO stats (key, value)
+        SELECT 'season_points:' || s, SUM(points)
+        FROM (SELECT {SEASON_OF_LOG.format(r='pl')} AS s, pl.points FROM point_logs pl)
+        WHERE s IS NOT NULL GROUP BY s''')
+
+def _m019_season_rollups(conn):
+    # La cubeta 'season' pasa a seguir SEASON_OF_LOG: también cuenta los ajustes sin evento
+    for name, body in _rollup_triggers().items():
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(f"CREATE TRIGGER {name} {body}")
+    conn.execute("DELETE FROM rollups WHERE dim = 'season'")
+    conn.execute(f'''INSERT INTO rollups (dim, bucket, user_id, points, entries)
+        SELECT 'season', CAST(s AS TEXT), user_id, SUM(points), COUNT(*)
+        FROM (SELECT {SEASON_OF_LOG.format(r='pl')} AS s, pl.user_id, pl.points FROM point_logs pl)
+        WHERE s IS NOT NULL GROUP BY s, user_id''')
+
+MIGRATIONS = [
+    (1, 'columna users.bio', _m001_users_bio),
+    (2, 'índices de consultas frecuentes', _m002_indexes),
+    (3, 'tabla app_state (generación de datos)', _m003_app_state),
+    (4, 'app_state.data_mtime', _m004_data_mtime),
+    (5, 'tabla bulk_requests (idempotencia)', _m005_bulk_requests),
+    (6, 'tabla ocr_jobs', _m006_ocr_jobs),
+    (7, 'tabla season_standings', _m007_season_standings),
+    (8, 'conciliación incremental de puntos', _m008_reconcile),
+    (9, 'índice FTS5 trigram de users', _m009_users_fts),
+    (10, 'tabla point_deltas (SSE)', _m010_point_deltas),
+    (11, 'tabla stats con triggers', _m011_stats),
+    (12, 'escalas de puntos por evento/temporada', _m012_scoring_scales),
+    (13, 'tabla import_jobs', _m013_import_jobs),
+    (14, 'generación de nicks (app_state.nick_gen)', _m014_nick_gen),
+    (15, 'tabla rank_history', _m015_rank_history),
+    (16, 'rollups por evento, mes y temporada', _m016_rollups),
+    (17, 'triggers de rollups con cubetas TEXT', _m017_rollup_text_buckets),
+    (18, 'stats por temporada con ajustes sin evento', _m018_season_stats),
+    (19, 'rollups por temporada con ajustes sin evento', _m019_season_rollups),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def migrate_db(path=None):
+    """Aplica las migraciones pendientes sobre la base en `path` (in situ)."""
+    conn = sqlite3.connect(path or DB_PATH, isolation_level=None, timeout=30)
+    try:
+        applied = []
+        for version, desc, migration in MIGRATIONS:
+            # BEGIN IMMEDIATE: si varios procesos arrancan a la vez, solo uno migra
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                current = conn.execute("PRAGMA user_version").fetchone()[0]
+                if current >= version:
+                    conn.execute("ROLLBACK")
+                    continue
+                migration(conn)
+                conn.execute(f"PRAGMA user_version = {version:d}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            applied.append(version)
+            print(f'[DB] Migración {version} aplicada: {desc}')
+        if applied:
+            conn.execute("ANALYZE")
+        return applied
+    finally:
+        conn.close()
+
 POINTS_SCALE = {
     1: 25, 2: 15, 3: 12, 4: 10,
     **{i: 5 for i in range(5, 9)},
@@ -105,6 +772,694 @@ POINTS_SCALE = {
 def get_pts(pos):
     return POINTS_SCALE.get(pos, 0)
 
+# Escala por defecto como lista: points[i] son los puntos de la posición i+1
+DEFAULT_SCALE = [get_pts(p) for p in range(1, max(POINTS_SCALE) + 1)]
+
+def scale_points(scale, pos):
+    return scale[pos - 1] if 1 <= pos <= len(scale) else 0
+
+def event_scale(conn, event_id):
+    """Escala del evento: la suya, si no la de su temporada, si no la por defecto."""
+    row = conn.execute('''
+        SELECT sc.points FROM events e
+        LEFT JOIN seasons s ON s.id = e.season
+        JOIN scoring_scales sc ON sc.id = COALESCE(e.scale_id, s.scale_id)
+        WHERE e.id = ?
+    ''', (event_id,)).fetchone()
+    return json.loads(row['points']) if row else DEFAULT_SCALE
+
+# ─── GENERACIÓN DE DATOS ──────────────────────────────────────────────────────
+# app_state.data_gen sube en 1 con cada escritura, dentro de la misma
+# transacción. Los índices y cachés en memoria de cada worker la comparan con
+# la suya para saber si otro proceso cambió la base.
+
+def bump_data_gen(conn):
+    conn.execute("UPDATE app_state SET value = value + 1 WHERE key = 'data_gen'")
+    conn.execute("UPDATE app_state SET value = CAST(strftime('%s','now') AS INTEGER) WHERE key = 'data_mtime'")
+    return current_data_gen(conn)
+
+def current_data_gen(conn):
+    return conn.execute("SELECT value FROM app_state WHERE key = 'data_gen'").fetchone()[0]
+
+def data_committed(gen, changes=None, reset=False):
+    """Se llama tras el commit de cada escritura con la generación nueva."""
+    RANK_INDEX.apply(gen, changes, reset)
+    _note_data_gen(gen, int(time.time()))
+
+# ─── ESCRITOR ÚNICO (GROUP COMMIT) ────────────────────────────────────────────
+# Las rutas admin que escriben no abren su propia transacción: mandan una
+# función job(conn) al escritor del worker. Un solo hilo toma todos los jobs
+# que lleguen juntos (hasta WRITE_BATCH_MAX, esperando WRITE_BATCH_WAIT), los
+# corre en UNA transacción con un SAVEPOINT por job y hace un único commit. Si
+# un job falla solo se deshace el suyo. Tras el commit se avisa a los índices
+# en memoria (on_commit) y cada llamador recibe su resultado o su excepción.
+# Un error en esos avisos se registra y fuerza la recarga del índice, pero no
+# deja al llamador esperando ni mata el hilo. Con varios workers, cada lote
+# corre bajo un flock sobre '<DB_PATH>.writer.lock': los escritores de los
+# distintos procesos se turnan en vez de chocar contra el bloqueo de SQLite.
+
+WRITE_BATCH_MAX  = 64
+WRITE_BATCH_WAIT = 0.002
+
+@contextmanager
+def writer_lock():
+    """Bloqueo exclusivo entre procesos para un lote del escritor."""
+    try:
+        import fcntl
+    except ImportError:                          # Windows: queda solo el bloqueo de SQLite
+        yield
+        return
+    with open(f'{DB_PATH}.writer.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+class _WriteJob:
+    __slots__ = ('fn', 'done', 'result', 'error', 'commits', 'metrics')
+
+    def __init__(self, fn, endpoint=None):
+        self.fn      = fn
+        self.done    = threading.Event()
+        self.result  = None
+        self.error   = None
+        self.commits = []
+        self.metrics = new_sql_metrics(endpoint)
+
+class Writer:
+    def __init__(self):
+        self._queue   = queue.Queue()
+        self._lock    = threading.Lock()
+        self._pid     = None
+        self._thread  = None
+        self._current = None
+        self._done_commits = []      # on_commit de los jobs ya hechos del lote en curso
+        self.stats    = {'jobs': 0, 'batches': 0, 'failed': 0, 'max_batch': 0}
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, fn):
+        """Corre fn(conn) en la transacción del escritor y devuelve su resultado."""
+        if threading.current_thread() is self._thread:
+            return fn(_pooled_connection())      # job que lanza otro job
+        self._ensure_started()
+        job = _WriteJob(fn, request.endpoint if has_request_context() else None)
+        self._queue.put(job)
+        job.done.wait()
+        m = g.get('metrics') if has_app_context() else None
+        if m is not None:
+            merge_sql_metrics(m, job.metrics)
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def on_commit(self, gen, changes=None, reset=False):
+        """Desde un job: llama a data_committed() cuando el lote se confirme."""
+        self._current.commits.append((gen, changes, reset))
+
+    def batch_commits(self):
+        """Desde un job: [(gen, changes, reset)] de los jobs anteriores del lote, aún sin confirmar."""
+        if threading.current_thread() is not self._thread:
+            return []
+        return list(self._done_commits)
+
+    def _next_batch(self):
+        jobs = [self._queue.get()]
+        deadline = time.monotonic() + WRITE_BATCH_WAIT
+        while len(jobs) < WRITE_BATCH_MAX:
+            try:
+                jobs.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return jobs
+
+    def _run_batch(self, conn, jobs):
+        conn.execute("BEGIN IMMEDIATE")
+        self._done_commits = []
+        try:
+            for job in jobs:
+                self._current = job
+                _job_metrics.current = job.metrics
+                conn.execute("SAVEPOINT job")
+                try:
+                    job.result = job.fn(conn)
+                    conn.execute("RELEASE job")
+                    self._done_commits.extend(job.commits)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                    job.error, job.commits = e, []
+            self._current = _job_metrics.current = None
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            for job in jobs:
+                if job.error is None:
+                    job.error, job.commits = e, []
+
+    def _finish(self, job):
+        try:
+            for gen, changes, reset in job.commits:
+                data_committed(gen, changes, reset)
+        except Exception as e:
+            # Los datos ya están confirmados: el índice se recarga en el próximo sync()
+            print(f'[WRITER] error tras el commit: {e!r}')
+            RANK_INDEX.invalidate()
+        finally:
+            job.done.set()
+
+    def _run(self):
+        while True:
+            jobs = self._next_batch()
+            try:
+                with writer_lock():
+                    self._run_batch(_pooled_connection(), jobs)
+            except Exception as e:               # p.ej. no se pudo abrir la conexión
+                self._current = _job_metrics.current = None
+                for job in jobs:
+                    job.error = job.error or e
+            for job in jobs:
+                self._finish(job)
+            self.stats['jobs'] += len(jobs)
+            self.stats['batches'] += 1
+            self.stats['failed'] += sum(job.error is not None for job in jobs)
+            self.stats['max_batch'] = max(self.stats['max_batch'], len(jobs))
+
+WRITER = Writer()
+
+# ─── RANKING EN MEMORIA ───────────────────────────────────────────────────────
+
+class RankIndex:
+    """
+    Índice de rangos por worker: lista ordenada de (-total_points, id).
+    rank() y position() son búsquedas binarias; las escrituras de este worker
+    se aplican en el lugar y los cambios de otros procesos fuerzan una recarga.
+    """
+
+    def __init__(self):
+        self._lock   = threading.RLock()
+        self._keys   = []
+        self._points = {}
+        self.gen     = None
+        self.loads   = 0
+
+    def _load(self, conn, gen):
+        rows = conn.execute("SELECT id, total_points FROM users").fetchall()
+        self._points = {r[0]: r[1] for r in rows}
+        self._keys   = sorted((-p, uid) for uid, p in self._points.items())
+        self.gen     = gen
+        self.loads  += 1
+
+    def sync(self, conn):
+        gen = current_data_gen(conn)
+        with self._lock:
+            if self.gen != gen:
+                self._load(conn, gen)
+        return self
+
+    @contextmanager
+    def pinned(self, conn):
+        """sync() y retiene el índice en esa generación hasta salir del with."""
+        with self._lock:
+            yield self.sync(conn)
+
+    def total(self):
+        return len(self._keys)
+
+    def rank(self, user_id):
+        """Rango de competición: 1 + jugadores con más puntos (empates comparten rango)."""
+        with self._lock:
+            points = self._points.get(user_id)
+            if points is None:
+                return None
+            return bisect.bisect_left(self._keys, (-points,)) + 1
+
+    def position(self, user_id):
+        """Posición en el orden (total_points DESC, id), igual que /ranking."""
+        with self._lock:
+            points = self._points.get(user_id)
+            if points is None:
+                return None
+            return bisect.bisect_left(self._keys, (-points, user_id)) + 1
+
+    def around(self, user_id, radius=3):
+        """[(posición, id, puntos)] de los jugadores alrededor de user_id."""
+        with self._lock:
+            pos = self.position(user_id)
+            if pos is None:
+                return []
+            start = max(0, pos - 1 - radius)
+            return [(start + i + 1, uid, -neg)
+                    for i, (neg, uid) in enumerate(self._keys[start:pos + radius])]
+
+    def moves(self, totals):
+        """
+        {id: (total_anterior, total_nuevo)} -> {id: (posición_anterior, posición_nueva)}.
+        El índice ya está en el estado nuevo; la posición anterior se obtiene
+        cambiando las claves nuevas de los jugadores movidos por las viejas.
+        """
+        with self._lock:
+            old_keys = sorted((-old, uid) for uid, (old, _) in totals.items() if old is not None)
+            new_keys = sorted((-self._points[uid], uid) for uid in totals if uid in self._points)
+            result = {}
+            for uid, (old, _) in totals.items():
+                old_pos = None
+                if old is not None:
+                    key = (-old, uid)
+                    old_pos = (bisect.bisect_left(self._keys, key) - bisect.bisect_left(new_keys, key)
+                               + bisect.bisect_left(old_keys, key) + 1)
+                result[uid] = (old_pos, self.position(uid))
+            return result
+
+    def ranks_after(self, totals, only=None):
+        """
+        {id: (total_anterior, total_nuevo)} -> {id: rango de competición con los
+        totales nuevos}, sin modificar el índice (que sigue en el estado anterior).
+        Con `only` devuelve solo esos ids; total_nuevo None es un jugador borrado.
+        """
+        with self._lock:
+            old_keys = sorted(-old for old, _ in totals.values() if old is not None)
+            new_keys = sorted(-new for _, new in totals.values() if new is not None)
+            return {uid: bisect.bisect_left(self._keys, (-new,)) - bisect.bisect_left(old_keys, -new)
+                         + bisect.bisect_left(new_keys, -new) + 1
+                    for uid, (_, new) in totals.items()
+                    if new is not None and (only is None or uid in only)}
+
+    def rank_diff(self, gen, pending, only=None):
+        """
+        pending = {id: total_nuevo} escritos después de la generación `gen` ->
+        {id: (rango_anterior, rango_nuevo)}, sin modificar el índice. Con `only`
+        devuelve solo esos ids. None si el índice no está en `gen`.
+        """
+        with self._lock:
+            if self.gen is None or self.gen != gen:
+                return None
+            after = self.ranks_after({uid: (self._points.get(uid), new) for uid, new in pending.items()}, only)
+            return {uid: (self.rank(uid), rank) for uid, rank in after.items()}
+
+    def invalidate(self):
+        with self._lock:
+            self.gen = None
+
+    def apply(self, new_gen, changes=None, reset=False):
+        """
+        Aplica una escritura ya confirmada. `changes` es {id: nuevo_total} (None
+        si el usuario se borró). Si la generación no es la siguiente a la nuestra
+        hubo escrituras de otro proceso y se recarga en el próximo sync().
+        """
+        with self._lock:
+            if self.gen is not None and self.gen >= new_gen:
+                return
+            if self.gen != new_gen - 1:
+                self.gen = None
+                return
+            if reset:
+                self._points = dict.fromkeys(self._points, 0)
+                self._keys   = sorted((0, uid) for uid in self._points)
+            for uid, points in (changes or {}).items():
+                old = self._points.pop(uid, None)
+                if old is not None:
+                    del self._keys[bisect.bisect_left(self._keys, (-old, uid))]
+                if points is not None:
+                    self._points[uid] = points
+                    bisect.insort(self._keys, (-points, uid))
+            self.gen = new_gen
+
+RANK_INDEX = RankIndex()
+
+def rank_index(conn):
+    # Las lecturas del snapshot tienen su propio índice: así una copia algo
+    # atrasada no obliga a recargar el del archivo
+    index = SNAPSHOT.ranks if isinstance(conn, SnapshotConnection) else RANK_INDEX
+    return index.sync(conn)
+
+# ─── SNAPSHOT DE LECTURA ──────────────────────────────────────────────────────
+# Con READ_SNAPSHOT=1 cada worker guarda en memoria una copia de las tablas del
+# ranking (SNAPSHOT_TABLES, con sus índices) y el inicio, /ranking y
+# /api/ranking leen de ella con read_db(); el resto (perfil, historial,
+# rollups) y las escrituras siguen yendo al archivo. La copia se rehace cuando
+# cambia la generación de datos, como mucho una vez cada READ_SNAPSHOT_INTERVAL segundos,
+# y mientras se rehace las lecturas siguen sobre la anterior. Cada request abre
+# su propia conexión a la base en memoria (cache=shared) y la cierra al
+# terminar, así la copia vieja se libera en cuanto nadie la usa.
+
+READ_SNAPSHOT          = os.environ.get('READ_SNAPSHOT', '0') == '1'
+READ_SNAPSHOT_INTERVAL = float(os.environ.get('READ_SNAPSHOT_INTERVAL', 1.0))
+SNAPSHOT_TABLES        = ('users', 'seasons', 'stats', 'app_state')
+
+class SnapshotConnection(PooledConnection):
+    """Conexión de solo lectura a la copia en memoria."""
+
+class ReadSnapshot:
+    def __init__(self):
+        self._lock   = threading.Lock()       # un solo refresco a la vez
+        self._keeper = None                   # mantiene viva la base en memoria
+        self._seq    = 0
+        self.name    = None
+        self.gen     = None
+        self.pid     = None
+        self.ranks   = RankIndex()            # rangos de la copia, no del archivo
+        self.refreshed_at = 0.0
+        self.stale_since  = None
+        self.disk_gen     = None
+        self.stats = {'refreshes': 0, 'failures': 0, 'bytes': 0, 'last_refresh_ms': 0.0}
+        self.refresh_hist   = Histogram(LATENCY_BUCKETS, label='snapshot')
+        self.staleness_hist = Histogram(LATENCY_BUCKETS, label='snapshot')
+
+    def ensure(self, gen):
+        """Refresca si la copia no es de la generación `gen`; devuelve la generación de la copia."""
+        if self.pid != os.getpid():
+            # Tras un fork la base en memoria del padre no sirve
+            self.name = self.gen = self._keeper = None
+            self.pid = os.getpid()
+        self.disk_gen = gen
+        if self.gen == gen:
+            return self.gen
+        now = time.monotonic()
+        if self.stale_since is None:
+            self.stale_since = now
+        if self.name is not None and now - self.refreshed_at < READ_SNAPSHOT_INTERVAL:
+            return self.gen
+        # La primera copia se espera; después, quien no consigue el lock sigue con la vieja
+        if self._lock.acquire(blocking=self.name is None):
+            try:
+                if self.gen != gen:
+                    self._refresh()
+            finally:
+                self._lock.release()
+        return self.gen
+
+    def _refresh(self):
+        start = time.perf_counter()
+        self._seq += 1
+        name = f'file:arena-snapshot-{os.getpid()}-{self._seq}?mode=memory&cache=shared'
+        keeper = sqlite3.connect(name, uri=True, check_same_thread=False, isolation_level=None)
+        try:
+            # Una sola transacción de lectura sobre el archivo: todas las tablas de la misma foto
+            keeper.execute("ATTACH DATABASE ? AS src", (DB_PATH,))
+            keeper.execute("BEGIN")
+            marks = ','.join('?' * len(SNAPSHOT_TABLES))
+            schema = keeper.execute(
+                f"SELECT type, tbl_name, sql FROM src.sqlite_master WHERE tbl_name IN ({marks}) "
+                "AND type IN ('table', 'index') AND sql IS NOT NULL ORDER BY type = 'index'", SNAPSHOT_TABLES
+            ).fetchall()
+            for kind, table, sql in schema:
+                keeper.execute(sql)                   # sin calificar: se crea en main
+                if kind == 'table':
+                    keeper.execute(f"INSERT INTO main.{table} SELECT * FROM src.{table}")
+            keeper.execute("COMMIT")
+            keeper.execute("DETACH DATABASE src")
+            gen = keeper.execute("SELECT value FROM app_state WHERE key = 'data_gen'").fetchone()[0]
+            size = keeper.execute("PRAGMA page_count").fetchone()[0] * keeper.execute("PRAGMA page_size").fetchone()[0]
+        except sqlite3.Error:
+            keeper.close()
+            self.stats['failures'] += 1
+            raise
+        old, self._keeper = self._keeper, keeper
+        self.name, self.gen = name, gen
+        if old is not None:
+            old.close()
+        elapsed = time.perf_counter() - start
+        self.refreshed_at = time.monotonic()
+        with METRICS_LOCK:
+            self.refresh_hist.observe('refresh', elapsed)
+            if self.stale_since is not None:
+                self.staleness_hist.observe('refresh', self.refreshed_at - self.stale_since)
+        self.stale_since = None if gen == self.disk_gen else self.refreshed_at
+        self.stats.update(refreshes=self.stats['refreshes'] + 1, bytes=size,
+                          last_refresh_ms=round(elapsed * 1000, 2))
+
+    def connect(self):
+        conn = sqlite3.connect(self.name, uri=True, factory=SnapshotConnection,
+                               cached_statements=DB_STATEMENT_CACHE)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def info(self):
+        age = time.monotonic() - self.refreshed_at if self.name else None
+        return dict(self.stats, enabled=READ_SNAPSHOT, gen=self.gen, disk_gen=self.disk_gen,
+                    age_seconds=round(age, 3) if age is not None else None)
+
+    def metric_lines(self):
+        info = self.info()
+        lines = self.refresh_hist.render('arena_snapshot_refresh_seconds',
+                                         'Tiempo de copiar la base al snapshot en memoria.')
+        lines += self.staleness_hist.render('arena_snapshot_staleness_seconds',
+                                            'Tiempo que el snapshot sirvió datos viejos antes de refrescarse.')
+        lines += ['# TYPE arena_snapshot_refreshes counter', f"arena_snapshot_refreshes {info['refreshes']}",
+                  '# TYPE arena_snapshot_bytes gauge', f"arena_snapshot_bytes {info['bytes']}",
+                  '# TYPE arena_snapshot_age_seconds gauge', f"arena_snapshot_age_seconds {info['age_seconds'] or 0}",
+                  '# TYPE arena_snapshot_lag_generations gauge',
+                  f"arena_snapshot_lag_generations {(info['disk_gen'] or 0) - (info['gen'] or 0)}"]
+        return lines
+
+SNAPSHOT = ReadSnapshot()
+
+def read_db():
+    """Conexión para lecturas públicas: la copia en memoria si READ_SNAPSHOT, si no get_db()."""
+    if not READ_SNAPSHOT:
+        return get_db()
+    if 'read_db' not in g:
+        SNAPSHOT.ensure(data_generation()[0])
+        g.read_db = SNAPSHOT.connect()
+    return g.read_db
+
+# ─── ESTÁTICOS Y COMPRESIÓN ───────────────────────────────────────────────────
+# El CSS y el JS compartidos viven en static/ y las plantillas los enlazan con
+# asset_url(), que agrega el hash del contenido: esa URL no cambia mientras no
+# cambie el archivo, así que se sirve con caché de un año. HTML, JSON y los
+# estáticos de texto se comprimen (brotli si está instalado, si no gzip) cuando
+# pasan de COMPRESS_MIN_BYTES.
+
+STATIC_MAX_AGE     = 365 * 24 * 3600
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+COMPRESS_MIMETYPES = {'text/html', 'application/json', 'text/css', 'text/javascript', 'application/javascript'}
+GZIP_LEVEL         = 6
+BROTLI_QUALITY     = 5
+
+_asset_hashes = {}           # archivo -> (mtime, hash)
+_static_encoded = {}         # (archivo, hash, encoding) -> bytes comprimidos
+_brotli = None
+
+def asset_hash(filename):
+    """Hash corto del contenido de static/<filename>, recalculado solo si cambia su mtime."""
+    path = os.path.join(app.static_folder, filename)
+    mtime = os.stat(path).st_mtime_ns
+    cached = _asset_hashes.get(filename)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as f:
+            cached = _asset_hashes[filename] = (mtime, hashlib.sha256(f.read()).hexdigest()[:12])
+    return cached[1]
+
+@app.template_global()
+def asset_url(filename):
+    return url_for('static', filename=filename, v=asset_hash(filename))
+
+def brotli_module():
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return _brotli or None
+
+def negotiate_encoding(size, mimetype):
+    """'br', 'gzip' o None según tamaño, tipo y lo que acepte el cliente."""
+    if size < COMPRESS_MIN_BYTES or mimetype not in COMPRESS_MIMETYPES:
+        return None
+    if request.accept_encodings['br'] and brotli_module():
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+def compress_body(data, encoding):
+    if encoding == 'br':
+        return brotli_module().compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, GZIP_LEVEL, mtime=0)
+
+def decompress_body(data, encoding):
+    if encoding == 'br':
+        return brotli_module().decompress(data)
+    if encoding == 'gzip':
+        return gzip.decompress(data)
+    return data
+
+def _static_response(response):
+    filename = request.view_args.get('filename', '')
+    try:
+        digest = asset_hash(filename)
+    except OSError:
+        return response
+    if response.status_code != 200 or request.args.get('v') != digest:
+        # Sin hash (o con uno viejo) queda la revalidación por ETag de Flask
+        return response
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = STATIC_MAX_AGE
+    response.cache_control.immutable = True
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(response.content_length or 0, response.mimetype)
+    if encoding:
+        key = (filename, digest, encoding)
+        body = _static_encoded.get(key)
+        if body is None:
+            response.direct_passthrough = False
+            body = _static_encoded[key] = compress_body(response.get_data(), encoding)
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        response.headers.pop('Accept-Ranges', None)     # los rangos serían sobre el archivo sin comprimir
+    return response
+
+@app.after_request
+def compress_response(response):
+    if request.endpoint == 'static':
+        return _static_response(response)
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(response.content_length or 0, response.mimetype)
+    if encoding:
+        response.set_data(compress_body(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+# ─── CACHÉ DE PÁGINAS PÚBLICAS ────────────────────────────────────────────────
+# Las páginas públicas se guardan ya renderizadas, con clave (ruta, query,
+# estado de sesión, generación). La generación se relee de SQLite como mucho
+# una vez cada GEN_CHECK_INTERVAL segundos, así que los refrescos seguidos no
+# tocan ni SQLite ni Jinja. Las escrituras de este worker la actualizan al
+# instante desde data_committed().
+
+GEN_CHECK_INTERVAL = 1.0
+PAGE_CACHE_SIZE    = 512
+
+_gen_lock  = threading.Lock()
+_gen_state = {'gen': None, 'mtime': 0, 'checked': 0.0}
+
+class PageCache:
+    def __init__(self, max_entries=PAGE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+PAGE_CACHE = PageCache()
+
+def _note_data_gen(gen, mtime):
+    with _gen_lock:
+        changed = gen != _gen_state['gen']
+        _gen_state.update(gen=gen, mtime=mtime, checked=time.monotonic())
+    if changed:
+        PAGE_CACHE.clear()
+
+def data_generation():
+    """(generación, unix mtime) de los datos, releída como mucho cada GEN_CHECK_INTERVAL."""
+    with _gen_lock:
+        if time.monotonic() - _gen_state['checked'] < GEN_CHECK_INTERVAL:
+            return _gen_state['gen'], _gen_state['mtime']
+    conn = get_db()
+    rows = dict(conn.execute("SELECT key, value FROM app_state WHERE key IN ('data_gen', 'data_mtime')").fetchall())
+    conn.close()
+    _note_data_gen(rows['data_gen'], rows.get('data_mtime', 0))
+    return rows['data_gen'], rows.get('data_mtime', 0)
+
+def _session_variant():
+    # La navegación y algunos botones cambian según haya usuario o admin logueado
+    return ('u' if 'user_id' in session else '') + ('a' if 'admin_id' in session else '')
+
+def cached_page(f):
+    """Sirve la respuesta desde PAGE_CACHE con ETag/Last-Modified y 304."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        gen, mtime = data_generation()
+        if READ_SNAPSHOT:
+            # La página sale de la copia en memoria: la clave lleva su generación
+            gen = SNAPSHOT.ensure(gen)
+        key = (request.endpoint, request.query_string, _session_variant(), gen)
+        etag = f'g{gen}-' + hashlib.md5(repr(key).encode()).hexdigest()[:12]
+        entry = PAGE_CACHE.get(key)
+        if entry is None:
+            rv = make_response(f(*args, **kwargs))
+            if rv.status_code != 200:
+                return rv
+            entry = (rv.get_data(), rv.mimetype, {})
+            PAGE_CACHE.set(key, entry)
+        body, mimetype, encoded = entry
+        encoding = negotiate_encoding(len(body), mimetype)
+        if encoding:
+            # La versión comprimida se guarda junto a la entrada: se comprime una vez por generación
+            if encoding not in encoded:
+                encoded[encoding] = compress_body(body, encoding)
+            body = encoded[encoding]
+        resp = make_response(body)
+        resp.mimetype = mimetype
+        resp.vary.add('Accept-Encoding')
+        if encoding:
+            resp.headers['Content-Encoding'] = encoding
+            etag = f'{etag}-{encoding}'
+        resp.set_etag(etag)
+        resp.last_modified = mtime
+        resp.cache_control.private = True
+        resp.cache_control.no_cache = True
+        return resp.make_conditional(request)
+    return decorated
+
+def user_totals(conn, user_ids):
+    ids = list(user_ids)
+    totals = dict.fromkeys(ids)
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        marks = ','.join('?' * len(chunk))
+        rows = conn.execute(f"SELECT id, total_points FROM users WHERE id IN ({marks})", chunk).fetchall()
+        totals.update((r[0], r[1]) for r in rows)
+    return totals
+
+def read_stats(conn, *keys):
+    """Lee contadores de la tabla stats (una fila por clave, 0 si no existe)."""
+    marks = ','.join('?' * len(keys))
+    found = dict(conn.execute(f"SELECT key, value FROM stats WHERE key IN ({marks})", keys).fetchall())
+    return [found.get(k, 0) for k in keys]
+
+def like_contains(q):
+    """Patrón LIKE de subcadena con %, _ y \\ escapados (usar con ESCAPE '\\')."""
+    return '%' + q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
 def hash_pw(pw):
     return hashlib.sha256(pw.encode()).hexdigest()
 
@@ -127,26 +1482,313 @@ def admin_required(f):
 # ─── PUBLIC ROUTES ────────────────────────────────────────────────────────────
 
 @app.route('/')
+@cached_page
 def index():
-    conn = get_db()
+    conn = read_db()
     users = conn.execute(
-        "SELECT username, discord, minecraft_nick, total_points, season_points FROM users ORDER BY total_points DESC LIMIT 50"
+        "SELECT id, username, discord, minecraft_nick, total_points, season_points FROM users ORDER BY total_points DESC, id LIMIT 50"
     ).fetchall()
-    total_users = conn.execute("SELECT COUNT(*) as c FROM users").fetchone()['c']
-    total_events = conn.execute("SELECT COUNT(*) as c FROM events").fetchone()['c']
+    total_users, total_events = read_stats(conn, 'users', 'events')
     season = conn.execute("SELECT * FROM seasons WHERE is_active=1 ORDER BY id DESC LIMIT 1").fetchone()
     conn.close()
     return render_template('index.html', users=users, total_users=total_users,
                            total_events=total_events, season=season)
 
+# El ranking se ordena por (total_points DESC, id ASC) y se pagina por keyset:
+# el cursor guarda puntos, id y rango de la última fila entregada, así la
+# página siguiente no necesita OFFSET ni volver a contar filas.
+
+RANKING_PAGE_SIZE = 50
+RANKING_MAX_PAGE  = 200
+RANKING_FIELDS    = "id, username, discord, minecraft_nick, total_points, season_points"
+
+def encode_rank_cursor(row):
+    return f"{row['total_points']}.{row['id']}.{row['rank']}"
+
+def decode_rank_cursor(cursor):
+    try:
+        points, user_id, rank = (int(p) for p in cursor.split('.'))
+    except (AttributeError, ValueError):
+        return None
+    return points, user_id, rank
+
+def ranking_page(conn, cursor=None, limit=RANKING_PAGE_SIZE):
+    """Devuelve (filas, next_cursor). Cada fila trae su rango global."""
+    if cursor:
+        points, last_id, last_rank = cursor
+        rows = conn.execute(
+            f"SELECT {RANKING_FIELDS} FROM users "
+            "WHERE total_points < ? OR (total_points = ? AND id > ?) "
+            "ORDER BY total_points DESC, id LIMIT ?",
+            (points, points, last_id, limit + 1)
+        ).fetchall()
+    else:
+        last_rank = 0
+        rows = conn.execute(
+            f"SELECT {RANKING_FIELDS} FROM users ORDER BY total_points DESC, id LIMIT ?",
+            (limit + 1,)
+        ).fetchall()
+    users = [dict(r, rank=last_rank + i) for i, r in enumerate(rows[:limit], 1)]
+    next_cursor = encode_rank_cursor(users[-1]) if len(rows) > limit else None
+    return users, next_cursor
+
+def ranking_search(conn, q, limit=RANKING_PAGE_SIZE):
+    """
+    Busca jugadores y devuelve cada coincidencia con su rango global real.
+    Desde 3 caracteres resuelve la subcadena con users_fts (trigram), como
+    search_users(); con menos, o sin FTS5, recorre users con LIKE.
+    """
+    if len(q) >= 3 and _has_users_fts(conn):
+        phrase = '"' + q.replace('"', '""') + '"'
+        rows = conn.execute(
+            f"SELECT {RANKING_FIELDS} FROM users u "
+            "WHERE id IN (SELECT rowid FROM users_fts WHERE users_fts MATCH ?) "
+            "ORDER BY total_points DESC, id LIMIT ?",
+            (phrase, limit)
+        ).fetchall()
+    else:
+        like = like_contains(q)
+        rows = conn.execute(
+            f"SELECT {RANKING_FIELDS} FROM users u "
+            "WHERE username LIKE ? ESCAPE '\\' OR minecraft_nick LIKE ? ESCAPE '\\' OR discord LIKE ? ESCAPE '\\' "
+            "ORDER BY total_points DESC, id LIMIT ?",
+            (like, like, like, limit)
+        ).fetchall()
+    index = rank_index(conn)
+    return [dict(r, rank=index.position(r['id'])) for r in rows]
+
+def _page_limit():
+    try:
+        limit = int(request.args.get('limit', RANKING_PAGE_SIZE))
+    except ValueError:
+        limit = RANKING_PAGE_SIZE
+    return max(1, min(limit, RANKING_MAX_PAGE))
+
 @app.route('/ranking')
+@cached_page
 def ranking():
+    conn = read_db()
+    users, next_cursor = ranking_page(conn)
+    total_users, = read_stats(conn, 'users')
+    conn.close()
+    return render_template('ranking.html', users=users, next_cursor=next_cursor,
+                           total_users=total_users, page_size=RANKING_PAGE_SIZE)
+
+@app.route('/api/ranking')
+@cached_page
+def api_ranking():
+    q      = request.args.get('q', '').strip()
+    limit  = _page_limit()
+    cursor = request.args.get('cursor')
+    # El snapshot no copia users_fts: las búsquedas van al archivo
+    conn = get_db() if q else read_db()
+    if q:
+        users, next_cursor = ranking_search(conn, q, limit), None
+    else:
+        decoded = decode_rank_cursor(cursor) if cursor else None
+        if cursor and not decoded:
+            conn.close()
+            return jsonify({'error': 'Cursor inválido'}), 400
+        users, next_cursor = ranking_page(conn, decoded, limit)
+    conn.close()
+    return jsonify({'users': users, 'next_cursor': next_cursor})
+
+# Tablas de posiciones por cubeta desde rollups: dim = event | month | season y
+# bucket = id del evento, 'AAAA-MM' o id de la temporada. Mismo keyset que el
+# ranking sobre (points DESC, user_id) dentro de la cubeta; idx_rollups_rank cubre
+# la consulta, así que cada página cuesta lo mismo sin importar el historial.
+
+def default_bucket(conn, dim):
+    if dim == 'month':
+        return datetime.now().strftime('%Y-%m')
+    if dim == 'season':
+        row = conn.execute("SELECT id FROM seasons WHERE is_active=1 ORDER BY id DESC LIMIT 1").fetchone()
+        return str(row['id']) if row else None
+    return None
+
+def rollup_page(conn, dim, bucket, cursor=None, limit=RANKING_PAGE_SIZE):
+    """Devuelve (filas, next_cursor) de la cubeta, con la posición de cada fila."""
+    if cursor:
+        points, last_id, last_rank = cursor
+        rows = conn.execute(
+            "SELECT user_id, points, entries FROM rollups WHERE dim = ? AND bucket = ? "
+            "AND (points < ? OR (points = ? AND user_id > ?)) ORDER BY points DESC, user_id LIMIT ?",
+            (dim, bucket, points, points, last_id, limit + 1)
+        ).fetchall()
+    else:
+        last_rank = 0
+        rows = conn.execute(
+            "SELECT user_id, points, entries FROM rollups WHERE dim = ? AND bucket = ? "
+            "ORDER BY points DESC, user_id LIMIT ?",
+            (dim, bucket, limit + 1)
+        ).fetchall()
+    page = rows[:limit]
+    names = {}
+    if page:
+        marks = ','.join('?' * len(page))
+        names = {r['id']: r for r in conn.execute(
+            f"SELECT id, username, minecraft_nick FROM users WHERE id IN ({marks})", [r['user_id'] for r in page]
+        )}
+    users = [{'rank': last_rank + i, 'id': r['user_id'], 'points': r['points'], 'entries': r['entries'],
+              'username': names[r['user_id']]['username'], 'minecraft_nick': names[r['user_id']]['minecraft_nick']}
+             for i, r in enumerate(page, 1) if r['user_id'] in names]
+    next_cursor = f"{page[-1]['points']}.{page[-1]['user_id']}.{last_rank + len(page)}" if len(rows) > limit else None
+    return users, next_cursor
+
+@app.route('/api/leaderboard')
+@cached_page
+def api_leaderboard():
+    dim    = request.args.get('dim', 'season')
+    bucket = request.args.get('bucket', '').strip()
+    cursor = request.args.get('cursor')
+    if dim not in ROLLUP_BUCKETS:
+        return jsonify({'error': f"dim debe ser uno de: {', '.join(ROLLUP_BUCKETS)}"}), 400
+    decoded = decode_rank_cursor(cursor) if cursor else None
+    if cursor and not decoded:
+        return jsonify({'error': 'Cursor inválido'}), 400
     conn = get_db()
-    users = conn.execute(
-        "SELECT username, discord, minecraft_nick, total_points, season_points FROM users ORDER BY total_points DESC"
-    ).fetchall()
+    bucket = bucket or default_bucket(conn, dim)
+    if not bucket:
+        conn.close()
+        return jsonify({'error': 'Falta bucket'}), 400
+    users, next_cursor = rollup_page(conn, dim, bucket, decoded, _page_limit())
+    conn.close()
+    return jsonify({'dim': dim, 'bucket': bucket, 'users': users, 'next_cursor': next_cursor})
+
+# ─── DELTAS EN VIVO (SSE) ─────────────────────────────────────────────────────
+# Las escrituras de puntos guardan en point_deltas (misma transacción) el total
+# anterior y el nuevo de cada jugador. En cada worker UN hilo publicador mira la
+# generación, lee los deltas nuevos, calcula posición anterior/nueva con
+# RANK_INDEX y los reparte a todos los suscriptores de /api/ranking/stream. Los
+# suscriptores no leen la base. El id de cada evento SSE es la generación, así
+# que un cliente que reconecta recupera lo que se perdió (si sigue en memoria).
+
+SSE_POLL_INTERVAL = 0.5
+SSE_HEARTBEAT     = 15
+SSE_BACKLOG       = 256
+DELTA_KEEP_GENS   = 5000
+
+def record_point_deltas(conn, gen, old_totals, new_totals):
+    conn.executemany(
+        "INSERT INTO point_deltas (gen, user_id, old_total, new_total) VALUES (?,?,?,?)",
+        [(gen, uid, old_totals.get(uid), new) for uid, new in new_totals.items()]
+    )
+    conn.execute("DELETE FROM point_deltas WHERE gen < ?", (gen - DELTA_KEEP_GENS,))
+
+class DeltaHub:
+    def __init__(self, backlog=SSE_BACKLOG):
+        self._cond     = threading.Condition()
+        self._messages = deque(maxlen=backlog)      # (gen, json)
+        self.gen       = None
+        self.subscribers = 0
+
+    def publish(self, gen, payload):
+        with self._cond:
+            if payload is not None:
+                self._messages.append((gen, json.dumps(payload, separators=(',', ':'))))
+            self.gen = gen
+            self._cond.notify_all()
+
+    def _pending(self, cursor):
+        return [m for m in self._messages if m[0] > cursor]
+
+    def listen(self, last_gen=None):
+        with self._cond:
+            self.subscribers += 1
+            cursor = self.gen if last_gen is None else last_gen
+            # Si el cliente pide algo que ya no está en memoria, que recargue
+            oldest = self._messages[0][0] if self._messages else self.gen
+            resync = last_gen is not None and oldest is not None and last_gen < oldest - 1
+        try:
+            yield 'retry: 3000\n\n'
+            if resync:
+                yield f'id: {self.gen}\nevent: resync\ndata: {{}}\n\n'
+                cursor = self.gen
+            while True:
+                with self._cond:
+                    pending = self._pending(cursor) if cursor is not None else []
+                    if not pending:
+                        self._cond.wait(SSE_HEARTBEAT)
+                        pending = self._pending(cursor) if cursor is not None else []
+                    if cursor is None:
+                        cursor = self.gen
+                if not pending:
+                    yield ': ping\n\n'
+                    continue
+                for gen, data in pending:
+                    yield f'id: {gen}\nevent: delta\ndata: {data}\n\n'
+                    cursor = gen
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+
+DELTA_HUB = DeltaHub()
+_publisher = {'pid': None}
+
+def _collect_deltas(conn, last_gen):
+    """Lee (en una instantánea) los deltas posteriores a last_gen. Devuelve (gen, payload)."""
+    conn.execute("BEGIN")
+    try:
+        # Las posiciones tienen que salir del índice en la misma generación que los deltas
+        with RANK_INDEX.pinned(conn) as index:
+            gen = index.gen
+            rows = conn.execute(
+                "SELECT user_id, old_total, new_total FROM point_deltas WHERE gen > ? AND gen <= ? ORDER BY gen",
+                (last_gen, gen)
+            ).fetchall()
+            if not rows:
+                return gen, None
+            totals = {}
+            for r in rows:
+                old = totals[r['user_id']][0] if r['user_id'] in totals else r['old_total']
+                totals[r['user_id']] = (old, r['new_total'])
+            moves = index.moves(totals)
+        ids = list(totals)
+        marks = ','.join('?' * len(ids))
+        info = {r['id']: r for r in conn.execute(
+            f"SELECT id, username, discord, minecraft_nick, total_points, season_points FROM users WHERE id IN ({marks})", ids
+        )}
+    finally:
+        conn.rollback()
+    deltas = []
+    for uid, (old_pos, new_pos) in moves.items():
+        if uid not in info or new_pos is None:
+            continue
+        deltas.append(dict(info[uid], old_rank=old_pos, new_rank=new_pos))
+    deltas.sort(key=lambda d: d['new_rank'])
+    return gen, {'gen': gen, 'from': last_gen, 'deltas': deltas}
+
+def _delta_publisher(last_gen):
+    while True:
+        time.sleep(SSE_POLL_INTERVAL)
+        try:
+            conn = _pooled_connection()
+            if current_data_gen(conn) != last_gen:
+                last_gen, payload = _collect_deltas(conn, last_gen)
+                DELTA_HUB.publish(last_gen, payload)
+        except Exception as e:
+            print(f'[SSE] error en el publicador: {e}')
+
+def start_delta_publisher(conn):
+    """Arranca (una vez por proceso) el hilo publicador desde la generación actual."""
+    with _gen_lock:
+        if _publisher['pid'] == os.getpid():
+            return
+        _publisher['pid'] = os.getpid()
+        gen = current_data_gen(conn)
+        DELTA_HUB.publish(gen, None)
+    threading.Thread(target=_delta_publisher, args=(gen,), name='delta-publisher', daemon=True).start()
+
+@app.route('/api/ranking/stream')
+def ranking_stream():
+    conn = get_db()
+    start_delta_publisher(conn)
     conn.close()
-    return render_template('ranking.html', users=users)
+    last_gen = request.headers.get('Last-Event-ID', type=int)
+    resp = Response(DELTA_HUB.listen(last_gen), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -176,12 +1818,14 @@ def register():
                 return render_template('register.html', error='Ese email ya está en uso.')
 
         now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        conn.execute(
+        cur = conn.execute(
             "INSERT INTO users (username, password, discord, minecraft_nick, email, created_at) VALUES (?,?,?,?,?,?)",
             (username, hash_pw(password), discord, minecraft, email, now)
         )
+        gen = bump_data_gen(conn)
         conn.commit()
         conn.close()
+        data_committed(gen, {cur.lastrowid: 0})
         return redirect(url_for('login', success='¡Cuenta creada! Ya puedes iniciar sesión.'))
 
     return render_template('register.html')
@@ -209,25 +1853,89 @@ def logout():
     session.clear()
     return redirect(url_for('index'))
 
+# Igual que el ranking, el historial se pagina por keyset sobre
+# (added_at DESC, id DESC). idx_point_logs_user_added lleva el rowid (= id) al
+# final, así que cada página es un rango del índice sin ordenar ni saltar filas.
+# Filtros opcionales: event_id y season (events.season).
+
+LOG_PAGE_SIZE = 30
+LOG_MAX_PAGE  = 200
+
+def encode_log_cursor(log):
+    return f"{log['added_at']}~{log['id']}"
+
+def decode_log_cursor(cursor):
+    try:
+        added_at, log_id = cursor.rsplit('~', 1)
+        return added_at, int(log_id)
+    except (AttributeError, ValueError):
+        return None
+
+def log_page(conn, user_id, cursor=None, limit=LOG_PAGE_SIZE, event_id=None, season=None):
+    """Devuelve (logs, next_cursor) del historial de un jugador, del más nuevo al más viejo."""
+    where, params = ["pl.user_id = ?"], [user_id]
+    if event_id is not None:
+        where.append("pl.event_id = ?"); params.append(event_id)
+    if season is not None:
+        where.append("e.season = ?"); params.append(season)
+    if cursor:
+        where.append("(pl.added_at, pl.id) < (?, ?)"); params.extend(cursor)
+    rows = conn.execute(f'''
+        SELECT pl.*, e.name as event_name
+        FROM point_logs pl
+        LEFT JOIN events e ON pl.event_id = e.id
+        WHERE {' AND '.join(where)}
+        ORDER BY pl.added_at DESC, pl.id DESC LIMIT ?
+    ''', params + [limit + 1]).fetchall()
+    logs = [dict(r) for r in rows[:limit]]
+    next_cursor = encode_log_cursor(logs[-1]) if len(rows) > limit else None
+    return logs, next_cursor
+
+def log_page_response(user_id, connect=get_db):
+    cursor = request.args.get('cursor')
+    decoded = decode_log_cursor(cursor) if cursor else None
+    if cursor and not decoded:
+        return jsonify({'error': 'Cursor inválido'}), 400
+    try:
+        limit    = max(1, min(int(request.args.get('limit', LOG_PAGE_SIZE)), LOG_MAX_PAGE))
+        event_id = request.args.get('event_id', type=int)
+        season   = request.args.get('season', type=int)
+    except ValueError:
+        return jsonify({'error': 'Parámetros inválidos'}), 400
+    conn = connect()
+    logs, next_cursor = log_page(conn, user_id, decoded, limit, event_id, season)
+    conn.close()
+    return jsonify({'logs': logs, 'next_cursor': next_cursor})
+
 @app.route('/profile')
 @login_required
 def profile():
     conn = get_db()
     user = conn.execute("SELECT * FROM users WHERE id=?", (session['user_id'],)).fetchone()
-    logs = conn.execute('''
-        SELECT pl.*, e.name as event_name
-        FROM point_logs pl
-        LEFT JOIN events e ON pl.event_id = e.id
-        WHERE pl.user_id=?
-        ORDER BY pl.added_at DESC LIMIT 30
-    ''', (session['user_id'],)).fetchall()
-    rank = conn.execute(
-        "SELECT COUNT(*)+1 as rank FROM users WHERE total_points > (SELECT total_points FROM users WHERE id=?)",
-        (session['user_id'],)
-    ).fetchone()['rank']
-    total_users = conn.execute("SELECT COUNT(*) as c FROM users").fetchone()['c']
+    logs, next_cursor = log_page(conn, session['user_id'])
+    index = rank_index(conn)
+    rank, total_users = index.rank(session['user_id']), index.total()
+    around = players_around(conn, index, session['user_id'])
     conn.close()
-    return render_template('profile.html', user=user, logs=logs, rank=rank, total_users=total_users)
+    return render_template('profile.html', user=user, logs=logs, rank=rank,
+                           total_users=total_users, around=around, next_cursor=next_cursor)
+
+@app.route('/profile/logs')
+@login_required
+def profile_logs():
+    return log_page_response(session['user_id'])
+
+def players_around(conn, index, user_id, radius=3):
+    near = index.around(user_id, radius)
+    if not near:
+        return []
+    marks = ','.join('?' * len(near))
+    names = {r['id']: r for r in conn.execute(
+        f"SELECT id, username, minecraft_nick FROM users WHERE id IN ({marks})", [n[1] for n in near]
+    )}
+    return [{'position': pos, 'id': uid, 'total_points': pts,
+             'username': names[uid]['username'], 'minecraft_nick': names[uid]['minecraft_nick']}
+            for pos, uid, pts in near if uid in names]
 
 @app.route('/profile/edit', methods=['POST'])
 @login_required
@@ -259,8 +1967,10 @@ def profile_edit():
         "UPDATE users SET minecraft_nick=?, email=?, bio=? WHERE id=?",
         (minecraft, email, bio, session['user_id'])
     )
+    gen = bump_data_gen(conn)
     conn.commit()
     conn.close()
+    data_committed(gen)
     return jsonify({'success': True})
 
 @app.route('/profile/change_password', methods=['POST'])
@@ -316,9 +2026,7 @@ def admin_logout():
 @admin_required
 def admin_dashboard():
     conn = get_db()
-    total_users  = conn.execute("SELECT COUNT(*) as c FROM users").fetchone()['c']
-    total_events = conn.execute("SELECT COUNT(*) as c FROM events").fetchone()['c']
-    total_points = conn.execute("SELECT SUM(points) as s FROM point_logs").fetchone()['s'] or 0
+    total_users, total_events, total_points = read_stats(conn, 'users', 'events', 'points')
     recent_logs  = conn.execute('''
         SELECT pl.*, u.username, u.minecraft_nick, e.name as event_name
         FROM point_logs pl
@@ -337,40 +2045,99 @@ def admin_dashboard():
         events=events, top3=top3,
         admin_username=session.get('admin_username'))
 
-@app.route('/admin/search_user')
+# ─── BÚSQUEDA DE JUGADORES ────────────────────────────────────────────────────
+# users_fts es una tabla FTS5 con tokenizer trigram, sincronizada por triggers.
+# Primero van las coincidencias exactas, luego las de prefijo (rangos sobre los
+# índices LOWER(...)) y al final las de subcadena que resuelve FTS5. Las
+# búsquedas repetidas se sirven desde un LRU con clave (generación, consulta).
+
+SEARCH_LIMIT      = 10
+SEARCH_FIELDS     = ('username', 'minecraft_nick', 'discord')
+SEARCH_CACHE      = PageCache(max_entries=256)
+_fts_available    = {}
+
+def _has_users_fts(conn):
+    if DB_PATH not in _fts_available:
+        _fts_available[DB_PATH] = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name='users_fts'"
+        ).fetchone() is not None
+    return _fts_available[DB_PATH]
+
+def search_users(conn, q, limit=SEARCH_LIMIT):
+    cols = "u.id, u.username, u.discord, u.minecraft_nick, u.total_points, u.season_points"
+    ql = q.lower()
+    found = OrderedDict()
+
+    def add(rows):
+        for r in rows:
+            if len(found) >= limit:
+                return
+            found.setdefault(r['id'], dict(r))
+
+    # Exactas y por prefijo: rango sobre LOWER(campo), usa los índices de expresión
+    for field in SEARCH_FIELDS:
+        add(conn.execute(
+            f"SELECT {cols} FROM users u WHERE LOWER(u.{field}) = ?", (ql,)
+        ).fetchall())
+    for field in SEARCH_FIELDS:
+        add(conn.execute(
+            f"SELECT {cols} FROM users u WHERE LOWER(u.{field}) >= ? AND LOWER(u.{field}) < ? "
+            "ORDER BY u.total_points DESC LIMIT ?",
+            (ql, ql + '\U0010ffff', limit)
+        ).fetchall())
+
+    if len(found) < limit:
+        if len(q) >= 3 and _has_users_fts(conn):
+            phrase = '"' + q.replace('"', '""') + '"'
+            add(conn.execute(
+                f"SELECT {cols} FROM users_fts f JOIN users u ON u.id = f.rowid "
+                "WHERE users_fts MATCH ? ORDER BY f.rank LIMIT ?",
+                (phrase, limit * 2)
+            ).fetchall())
+        else:
+            like = like_contains(q)
+            add(conn.execute(
+                f"SELECT {cols} FROM users u WHERE u.username LIKE ? ESCAPE '\\' "
+                "OR u.minecraft_nick LIKE ? ESCAPE '\\' OR u.discord LIKE ? ESCAPE '\\' LIMIT ?",
+                (like, like, like, limit)
+            ).fetchall())
+    return list(found.values())
+
+@app.route('/admin/search_user')
 @admin_required
 def admin_search_user():
     q = request.args.get('q', '').strip()
     if not q:
         return jsonify([])
-    conn = get_db()
-    users = conn.execute(
-        "SELECT id, username, discord, minecraft_nick, total_points, season_points FROM users WHERE username LIKE ? OR minecraft_nick LIKE ? OR discord LIKE ? LIMIT 10",
-        (f'%{q}%', f'%{q}%', f'%{q}%')
-    ).fetchall()
-    conn.close()
-    return jsonify([dict(u) for u in users])
+    gen, _ = data_generation()
+    key = (DB_PATH, gen, q.lower())
+    users = SEARCH_CACHE.get(key)
+    if users is None:
+        conn = get_db()
+        users = search_users(conn, q)
+        conn.close()
+        SEARCH_CACHE.set(key, users)
+    return jsonify(users)
 
 @app.route('/admin/user/<int:user_id>')
 @admin_required
 def admin_user_detail(user_id):
     conn = get_db()
     user = conn.execute("SELECT * FROM users WHERE id=?", (user_id,)).fetchone()
-    logs = conn.execute('''
-        SELECT pl.*, e.name as event_name
-        FROM point_logs pl
-        LEFT JOIN events e ON pl.event_id = e.id
-        WHERE pl.user_id=?
-        ORDER BY pl.added_at DESC
-    ''', (user_id,)).fetchall()
-    rank = conn.execute(
-        "SELECT COUNT(*)+1 as r FROM users WHERE total_points > (SELECT total_points FROM users WHERE id=?)",
-        (user_id,)
-    ).fetchone()['r']
+    logs, next_cursor = log_page(conn, user_id)
+    index = rank_index(conn)
+    rank = index.rank(user_id)
+    around = players_around(conn, index, user_id)
     conn.close()
     if not user:
         return jsonify({'error': 'Usuario no encontrado'}), 404
-    return jsonify({'user': dict(user), 'logs': [dict(l) for l in logs], 'rank': rank})
+    return jsonify({'user': dict(user), 'logs': logs, 'next_cursor': next_cursor,
+                    'rank': rank, 'around': around})
+
+@app.route('/admin/user/<int:user_id>/logs')
+@admin_required
+def admin_user_logs(user_id):
+    return log_page_response(user_id)
 
 @app.route('/admin/add_points', methods=['POST'])
 @admin_required
@@ -386,23 +2153,34 @@ def admin_add_points():
         return jsonify({'error': 'Datos incompletos'}), 400
 
     now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    conn = get_db()
-    user = conn.execute("SELECT * FROM users WHERE id=?", (user_id,)).fetchone()
-    if not user:
-        conn.close()
-        return jsonify({'error': 'Usuario no encontrado'}), 404
+    added_by = session['admin_username']
 
-    conn.execute(
-        "INSERT INTO point_logs (user_id, event_id, points, position, reason, added_by, added_at) VALUES (?,?,?,?,?,?,?)",
-        (user_id, event_id, points, position, reason, session['admin_username'], now)
-    )
-    conn.execute(
-        "UPDATE users SET total_points=total_points+?, season_points=season_points+? WHERE id=?",
-        (points, points, user_id)
-    )
-    conn.commit()
-    new_total = conn.execute("SELECT total_points FROM users WHERE id=?", (user_id,)).fetchone()['total_points']
-    conn.close()
+    def job(conn):
+        user = conn.execute("SELECT id FROM users WHERE id=?", (user_id,)).fetchone()
+        if not user:
+            return None
+        conn.execute(
+            "INSERT INTO point_logs (user_id, event_id, points, position, reason, added_by, added_at) VALUES (?,?,?,?,?,?,?)",
+            (user_id, event_id, points, position, reason, added_by, now)
+        )
+        conn.execute(
+            "UPDATE users SET total_points=total_points+?, season_points=season_points+? WHERE id=?",
+            (points, points, user_id)
+        )
+        new_total = conn.execute("SELECT total_points FROM users WHERE id=?", (user_id,)).fetchone()['total_points']
+        if event_id:
+            record_rank_history(conn, event_id, {user['id']: (new_total - points, new_total)}, now)
+        gen = bump_data_gen(conn)
+        record_point_deltas(conn, gen, {user['id']: new_total - points}, {user['id']: new_total})
+        WRITER.on_commit(gen, {user['id']: new_total})
+        return new_total
+
+    try:
+        new_total = WRITER.submit(job)
+    except sqlite3.IntegrityError:
+        return jsonify({'error': 'El jugador ya tiene puntos en este evento'}), 409
+    if new_total is None:
+        return jsonify({'error': 'Usuario no encontrado'}), 404
     return jsonify({'success': True, 'new_total': new_total})
 
 @app.route('/admin/remove_points', methods=['POST'])
@@ -410,18 +2188,25 @@ def admin_add_points():
 def admin_remove_points():
     data    = request.json
     log_id  = data.get('log_id')
-    conn = get_db()
-    log = conn.execute("SELECT * FROM point_logs WHERE id=?", (log_id,)).fetchone()
-    if not log:
-        conn.close()
+
+    def job(conn):
+        log = conn.execute("SELECT * FROM point_logs WHERE id=?", (log_id,)).fetchone()
+        if not log:
+            return False
+        conn.execute("DELETE FROM point_logs WHERE id=?", (log_id,))
+        before = user_totals(conn, [log['user_id']])
+        conn.execute(
+            "UPDATE users SET total_points=MAX(0,total_points-?), season_points=MAX(0,season_points-?) WHERE id=?",
+            (log['points'], log['points'], log['user_id'])
+        )
+        changes = user_totals(conn, [log['user_id']])
+        gen = bump_data_gen(conn)
+        record_point_deltas(conn, gen, before, changes)
+        WRITER.on_commit(gen, changes)
+        return True
+
+    if not WRITER.submit(job):
         return jsonify({'error': 'Log no encontrado'}), 404
-    conn.execute("DELETE FROM point_logs WHERE id=?", (log_id,))
-    conn.execute(
-        "UPDATE users SET total_points=MAX(0,total_points-?), season_points=MAX(0,season_points-?) WHERE id=?",
-        (log['points'], log['points'], log['user_id'])
-    )
-    conn.commit()
-    conn.close()
     return jsonify({'success': True})
 
 @app.route('/admin/add_event', methods=['POST'])
@@ -434,14 +2219,366 @@ def admin_add_event():
     if not name or not edate:
         return jsonify({'error': 'Nombre y fecha requeridos'}), 400
     now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    conn = get_db()
-    cur  = conn.execute(
-        "INSERT INTO events (name, event_date, description, created_by, created_at) VALUES (?,?,?,?,?)",
-        (name, edate, desc, session['admin_username'], now)
+    created_by = session['admin_username']
+
+    def job(conn):
+        # El evento queda asociado a la temporada activa
+        active = conn.execute("SELECT id FROM seasons WHERE is_active=1 ORDER BY id DESC LIMIT 1").fetchone()
+        cur  = conn.execute(
+            "INSERT INTO events (name, event_date, description, created_by, created_at, season) VALUES (?,?,?,?,?,?)",
+            (name, edate, desc, created_by, now, active['id'] if active else 1)
+        )
+        WRITER.on_commit(bump_data_gen(conn))
+        return cur.lastrowid
+
+    event_id = WRITER.submit(job)
+    return jsonify({'success': True, 'event_id': event_id, 'name': name, 'date': edate})
+
+# ─── ÍNDICE DE NICKS ──────────────────────────────────────────────────────────
+# Resolución de nicks en memoria por worker para la asignación masiva, la
+# importación y el OCR. Tres niveles: nick exacto (sin mayúsculas), nick
+# normalizado (0/o, 1/l/I, sin _ - . ni espacios) si es único, y candidatos
+# por trigramas + distancia de edición para los que no aparecen. El índice se
+# reconstruye cuando cambia app_state.nick_gen, que suben los triggers de users
+# al registrar, borrar o cambiar un nick (en cualquier worker).
+
+NICK_CONFUSABLES   = str.maketrans({'0': 'o', '1': 'l', 'i': 'l', '|': 'l',
+                                    '_': None, '-': None, '.': None, ' ': None})
+NICK_CANDIDATES    = 5
+NICK_MAX_DISTANCE  = 2
+NICK_GRAM_MAX_HITS = 5000       # trigramas más comunes que esto no aportan
+
+def normalize_nick(nick):
+    return nick.strip().lower().translate(NICK_CONFUSABLES)
+
+def _nick_grams(key):
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def edit_distance(a, b, limit):
+    """Levenshtein con transposiciones (OSA) y corte: devuelve limit + 1 en cuanto se pasa."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before, prev = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            d = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb))
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                d = min(d, before[j - 2] + 1)
+            cur.append(d)
+        if min(cur) > limit:
+            return limit + 1
+        before, prev = prev, cur
+    return prev[-1]
+
+class NickIndex:
+    def __init__(self):
+        self._lock  = threading.RLock()
+        self.gen    = None
+        self.loads  = 0
+        self._exact = {}      # nick en minúsculas -> id (el más antiguo)
+        self._norm  = {}      # nick normalizado -> [ids]
+        self._nicks = {}      # id -> (nick, normalizado)
+        self._grams = {}      # trigrama -> [ids]
+
+    def sync(self, conn):
+        gen = conn.execute("SELECT value FROM app_state WHERE key = 'nick_gen'").fetchone()[0]
+        with self._lock:
+            if self.gen != gen:
+                self._load(conn, gen)
+        return self
+
+    def _load(self, conn, gen):
+        exact, norm, nicks, grams = {}, {}, {}, {}
+        for uid, nick in conn.execute("SELECT id, minecraft_nick FROM users ORDER BY id"):
+            key = normalize_nick(nick)
+            exact.setdefault(nick.lower(), uid)
+            norm.setdefault(key, []).append(uid)
+            nicks[uid] = (nick, key)
+            for gram in _nick_grams(key):
+                grams.setdefault(gram, []).append(uid)
+        self._exact, self._norm, self._nicks, self._grams = exact, norm, nicks, grams
+        self.gen = gen
+        self.loads += 1
+
+    def resolve(self, nick):
+        """(user_id, nick real) o (None, None). El normalizado solo vale si es único."""
+        if not nick.strip():
+            return None, None
+        with self._lock:
+            uid = self._exact.get(nick.strip().lower())
+            if uid is None:
+                ids = self._norm.get(normalize_nick(nick), ())
+                uid = ids[0] if len(ids) == 1 else None
+            return (uid, self._nicks[uid][0]) if uid is not None else (None, None)
+
+    def candidates(self, nick, limit=NICK_CANDIDATES, max_distance=NICK_MAX_DISTANCE):
+        """Jugadores parecidos, ordenados por distancia y trigramas en común."""
+        key = normalize_nick(nick)
+        with self._lock:
+            shared = {}
+            for gram in _nick_grams(key):
+                hits = self._grams.get(gram, ())
+                if len(hits) > NICK_GRAM_MAX_HITS:
+                    continue
+                for uid in hits:
+                    shared[uid] = shared.get(uid, 0) + 1
+            found = []
+            for uid in sorted(shared, key=shared.get, reverse=True)[:limit * 10]:
+                real, other = self._nicks[uid]
+                dist = edit_distance(key, other, max_distance)
+                if dist <= max_distance:
+                    found.append((dist, -shared[uid], real.lower(), uid, real))
+            found.sort()
+            return [{'id': uid, 'minecraft_nick': real, 'distance': dist}
+                    for dist, _, _, uid, real in found[:limit]]
+
+NICK_INDEX = NickIndex()
+
+def nick_index(conn):
+    return NICK_INDEX.sync(conn)
+
+# ─── HISTORIAL DE RANGOS ──────────────────────────────────────────────────────
+# rank_history guarda, por cada jugador que suma puntos en un evento, su total y
+# su rango justo después. Se agrega en la misma transacción que los puntos
+# (asignación masiva, importación o puntos con evento): se reproducen sobre
+# RANK_INDEX, que es la foto anterior al lote del escritor, los cambios de los
+# jobs previos del lote más los de ese evento. Si el índice no está en esa
+# generación (escrituras de otro proceso), se carga uno temporal.
+# backfill-rank-history reconstruye la tabla con una pasada por point_logs en
+# orden de tiempo.
+
+RANK_HISTORY_LIMIT = 60
+RANK_HISTORY_MAX   = 500
+BACKFILL_BATCH     = 5000
+
+def record_rank_history(conn, event_id, totals, now):
+    """
+    totals = {id: (total_anterior, total_nuevo)} ya escritos en users. Hay que
+    llamarla antes de bump_data_gen(), con la generación previa todavía en app_state.
+    """
+    if not totals:
+        return
+    gen = current_data_gen(conn)
+    earlier = WRITER.batch_commits()
+    base = gen - len(earlier)
+    ranks = None
+    if ([c[0] for c in earlier] == list(range(base + 1, gen + 1))
+            and not any(reset for _, _, reset in earlier)):
+        pending = {}
+        for _, changes, _ in earlier:
+            pending.update(changes or {})
+        pending.update((uid, new) for uid, (_, new) in totals.items())
+        diff = RANK_INDEX.rank_diff(base, pending, only=totals)
+        if diff is not None:
+            ranks = {uid: new for uid, (_, new) in diff.items()}
+    if ranks is None:
+        index = RankIndex()
+        index._load(conn, gen)
+        ranks = {uid: index.rank(uid) for uid in totals}
+    conn.executemany(
+        "INSERT OR REPLACE INTO rank_history (user_id, event_id, total_points, rank, recorded_at) VALUES (?,?,?,?,?)",
+        [(uid, event_id, new, ranks[uid], now) for uid, (_, new) in totals.items()]
     )
-    conn.commit()
+
+def rank_series(conn, user_id, limit=RANK_HISTORY_LIMIT):
+    """Últimos `limit` puntos de la serie, del más viejo al más nuevo, en columnas."""
+    rows = conn.execute('''
+        SELECT rh.rank, rh.total_points, rh.recorded_at, e.name AS event_name
+        FROM rank_history rh
+        LEFT JOIN events e ON e.id = rh.event_id
+        WHERE rh.user_id = ?
+        ORDER BY rh.id DESC LIMIT ?
+    ''', (user_id, limit)).fetchall()[::-1]
+    return {'user_id': user_id,
+            'ranks':  [r['rank'] for r in rows],
+            'points': [r['total_points'] for r in rows],
+            'dates':  [r['recorded_at'][:10] for r in rows],
+            'events': [r['event_name'] for r in rows]}
+
+@app.route('/api/rank_history/<int:user_id>')
+@cached_page
+def api_rank_history(user_id):
+    limit = max(1, min(request.args.get('limit', RANK_HISTORY_LIMIT, type=int), RANK_HISTORY_MAX))
+    conn = get_db()
+    series = rank_series(conn, user_id, limit)
+    conn.close()
+    return jsonify(series)
+
+class RankCounter:
+    """Jugadores por total (árbol de Fenwick); crece solo si aparece un total fuera de rango."""
+
+    def __init__(self, lo=0, hi=1023):
+        self.counts = {}
+        self._build(lo, hi)
+
+    def _build(self, lo, hi):
+        self.lo, self.size = lo, hi - lo + 1
+        self.tree = [0] * (self.size + 1)
+        self.n = 0
+        counts, self.counts = self.counts, {}
+        for value, k in counts.items():
+            self.add(value, k)
+
+    def add(self, value, k=1):
+        if not self.lo <= value < self.lo + self.size:
+            span = self.size * 2
+            self._build(min(self.lo, value - span // 2), max(self.lo + self.size, value + span // 2))
+        self.counts[value] = self.counts.get(value, 0) + k
+        self.n += k
+        i = value - self.lo + 1
+        while i <= self.size:
+            self.tree[i] += k
+            i += i & -i
+
+    def rank(self, value):
+        """1 + jugadores con un total mayor que `value`."""
+        at_most, i = 0, min(value - self.lo + 1, self.size)
+        while i > 0:
+            at_most += self.tree[i]
+            i -= i & -i
+        return self.n - at_most + 1
+
+def backfill_rank_history(conn, batch_size=BACKFILL_BATCH):
+    """
+    Reconstruye rank_history recorriendo point_logs por (added_at, id) una sola
+    vez. Los logs de un mismo evento con la misma fecha son un cierre: tras
+    aplicarlos se anota el rango de sus jugadores. Bloquea las escrituras mientras
+    corre. Devuelve (logs leídos, filas escritas).
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM rank_history")
+        counter = RankCounter()
+        counter.add(0, conn.execute("SELECT COUNT(*) FROM users").fetchone()[0])
+        totals, pending, group, key = {}, [], [], None
+        scanned = written = 0
+
+        def close_group():
+            nonlocal written
+            for uid in group:
+                pending.append((uid, key[0], totals[uid], counter.rank(totals[uid]), key[1]))
+            group.clear()
+            if len(pending) >= batch_size:
+                written += len(pending)
+                conn.executemany(
+                    "INSERT OR REPLACE INTO rank_history (user_id, event_id, total_points, rank, recorded_at) VALUES (?,?,?,?,?)",
+                    pending
+                )
+                pending.clear()
+
+        cur = conn.execute("SELECT user_id, event_id, points, added_at FROM point_logs ORDER BY added_at, id")
+        for user_id, event_id, points, added_at in cur:
+            scanned += 1
+            if (event_id, added_at) != key:
+                close_group()
+                key = (event_id, added_at)
+            old = totals.get(user_id, 0)
+            totals[user_id] = old + points
+            counter.add(old, -1)
+            counter.add(old + points)
+            if event_id is not None:
+                group.append(user_id)
+        close_group()
+        written += len(pending)
+        conn.executemany(
+            "INSERT OR REPLACE INTO rank_history (user_id, event_id, total_points, rank, recorded_at) VALUES (?,?,?,?,?)",
+            pending
+        )
+        bump_data_gen(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return scanned, written
+
+@app.cli.command('backfill-rank-history')
+@click.option('--batch-size', default=BACKFILL_BATCH, show_default=True)
+def backfill_rank_history_command(batch_size):
+    """Reconstruye rank_history desde point_logs."""
+    start = time.perf_counter()
+    conn = get_db()
+    scanned, written = backfill_rank_history(conn, batch_size)
     conn.close()
-    return jsonify({'success': True, 'event_id': cur.lastrowid, 'name': name, 'date': edate})
+    print(f'[HISTORY] {scanned} logs leídos, {written} puntos de historial en {time.perf_counter() - start:.1f}s')
+
+# ─── ASIGNACIÓN MASIVA ────────────────────────────────────────────────────────
+# Los nicks se resuelven con el índice de nicks en memoria y los duplicados con
+# UNA consulta (tabla temporal unida a point_logs). Las escrituras van con
+# executemany dentro de una sola transacción (la del escritor). Con
+# idempotency_key, un reintento del mismo envío devuelve la respuesta guardada
+# sin volver a sumar puntos. Los nicks no encontrados vuelven con candidatos.
+
+def bulk_award(conn, event_id, results, added_by, now, idem_key=None):
+    """
+    Corre dentro de la transacción del llamador (un job del escritor).
+    Devuelve (respuesta, generación nueva o None, {user_id: nuevo_total}).
+    """
+    index = nick_index(conn)
+    rows = []
+    for seq, r in enumerate(results):
+        nick = (r.get('minecraft_nick') or '').strip()
+        rows.append((seq, nick, int(r.get('position', 999)), index.resolve(nick)[0] if nick else None))
+
+    if idem_key:
+        done = conn.execute("SELECT response FROM bulk_requests WHERE idem_key=?", (idem_key,)).fetchone()
+        if done:
+            return json.loads(done['response']), None, {}
+
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS bulk_rows (seq INTEGER PRIMARY KEY, nick TEXT, position INTEGER, user_id INTEGER)")
+    conn.execute("DELETE FROM temp.bulk_rows")
+    conn.executemany("INSERT INTO temp.bulk_rows (seq, nick, position, user_id) VALUES (?,?,?,?)", rows)
+    resolved = conn.execute('''
+        SELECT b.seq, b.nick, b.position, u.id AS user_id, u.minecraft_nick,
+               EXISTS(SELECT 1 FROM point_logs pl WHERE pl.user_id = u.id AND pl.event_id = ?) AS dup
+        FROM temp.bulk_rows b
+        LEFT JOIN users u ON u.id = b.user_id
+        ORDER BY b.seq
+    ''', (event_id,)).fetchall()
+    conn.execute("DELETE FROM temp.bulk_rows")
+
+    scale = event_scale(conn, event_id)
+    assigned, not_found, already = [], [], []
+    logs, awarded = [], {}
+    for r in resolved:
+        nick, pos, user_id = r['nick'], r['position'], r['user_id']
+        if user_id is None:
+            not_found.append(nick)
+            continue
+        # Duplicado en la base o repetido dentro del mismo envío
+        if r['dup'] or user_id in awarded:
+            already.append(nick)
+            continue
+        points = scale_points(scale, pos)
+        if points > 0:
+            awarded[user_id] = points
+            logs.append((user_id, event_id, points, pos, f'Posición #{pos}', added_by, now))
+            item = {'nick': nick, 'points': points, 'position': pos}
+            if r['minecraft_nick'].lower() != nick.lower():
+                item['matched'] = r['minecraft_nick']
+            assigned.append(item)
+
+    conn.executemany(
+        "INSERT INTO point_logs (user_id, event_id, points, position, reason, added_by, added_at) VALUES (?,?,?,?,?,?,?)",
+        logs
+    )
+    conn.executemany(
+        "UPDATE users SET total_points=total_points+?, season_points=season_points+? WHERE id=?",
+        [(pts, pts, uid) for uid, pts in awarded.items()]
+    )
+    response = {'assigned': assigned, 'not_found': not_found, 'already': already,
+                'candidates': {nick: index.candidates(nick) for nick in not_found if nick}}
+    if idem_key:
+        conn.execute(
+            "INSERT INTO bulk_requests (idem_key, event_id, response, created_by, created_at) VALUES (?,?,?,?,?)",
+            (idem_key, event_id, json.dumps(response), added_by, now)
+        )
+    changes = user_totals(conn, awarded)
+    record_rank_history(conn, event_id, {uid: (changes[uid] - pts, changes[uid]) for uid, pts in awarded.items()}, now)
+    gen = bump_data_gen(conn)
+    record_point_deltas(conn, gen, {uid: changes[uid] - pts for uid, pts in awarded.items()}, changes)
+    return response, gen, changes
 
 @app.route('/admin/bulk_points', methods=['POST'])
 @admin_required
@@ -452,103 +2589,521 @@ def admin_bulk_points():
     if not event_id or not results:
         return jsonify({'error': 'Datos incompletos'}), 400
 
+    idem_key = (request.headers.get('Idempotency-Key') or data.get('idempotency_key') or '').strip() or None
     now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    conn = get_db()
-    assigned  = []
-    not_found = []
-    already   = []
+    added_by = session['admin_username']
 
-    for r in results:
-        nick   = r.get('minecraft_nick', '').strip()
-        pos    = int(r.get('position', 999))
-        points = get_pts(pos)
+    def job(conn):
+        response, gen, changes = bulk_award(conn, event_id, results, added_by, now, idem_key)
+        if gen is not None:
+            WRITER.on_commit(gen, changes)
+        return response
 
-        user = conn.execute(
-            "SELECT * FROM users WHERE LOWER(minecraft_nick)=LOWER(?)", (nick,)
-        ).fetchone()
+    return jsonify(WRITER.submit(job))
 
-        if not user:
-            not_found.append(nick)
-            continue
+# ─── OCR ──────────────────────────────────────────────────────────────────────
+# Las imágenes se procesan en un pool de procesos acotado, fuera del hilo del
+# request. El admin recibe un job_id y consulta /admin/ocr_jobs/<id>; el estado
+# se guarda en la tabla ocr_jobs para que cualquier worker pueda responder.
+# Los textos ya reconocidos se cachean por hash SHA-256 del archivo.
+# OCR_BACKEND=fake lee el texto del chunk PNG "ocr_text" (pruebas sin Tesseract).
 
-        # Check if already assigned for this event
-        dup = conn.execute(
-            "SELECT id FROM point_logs WHERE user_id=? AND event_id=?",
-            (user['id'], event_id)
-        ).fetchone()
-        if dup:
-            already.append(nick)
+OCR_BACKEND    = os.environ.get('OCR_BACKEND', 'tesseract')
+OCR_WORKERS    = int(os.environ.get('OCR_WORKERS', '2'))
+OCR_MAX_IMAGES = 10
+OCR_MAX_WIDTH  = 1600
+OCR_CACHE_SIZE = 256
+
+_ocr_pool      = None
+_ocr_pool_pid  = None
+_ocr_lock      = threading.Lock()
+_ocr_cache     = OrderedDict()
+_ocr_jobs      = {}
+
+def preprocess_ocr_image(img, max_width=OCR_MAX_WIDTH):
+    """Escala de grises, recorte de bordes uniformes y reducción de tamaño."""
+    from PIL import Image, ImageChops, ImageOps
+    gray = ImageOps.exif_transpose(img).convert('L')
+    background = Image.new('L', gray.size, gray.getpixel((0, 0)))
+    bbox = ImageChops.difference(gray, background).getbbox()
+    if bbox:
+        gray = gray.crop(bbox)
+    if gray.width > max_width:
+        height = round(gray.height * max_width / gray.width)
+        gray = gray.resize((max_width, height), Image.LANCZOS)
+    return ImageOps.autocontrast(gray)
+
+def _ocr_image_bytes(data, backend):
+    """Corre dentro del pool de procesos: bytes de imagen -> texto."""
+    from PIL import Image
+    img = Image.open(io.BytesIO(data))
+    img.load()
+    fake_text = img.info.get('ocr_text', '')
+    prepared = preprocess_ocr_image(img)
+    if backend == 'fake':
+        return fake_text
+    import pytesseract
+    return pytesseract.image_to_string(prepared, lang='spa+eng')
+
+def parse_ocr_text(text):
+    import re
+    results = []
+    for line in text.strip().split('\n'):
+        line = line.strip()
+        if not line:
             continue
+        match = re.match(r'^[#\.]?(\d+)[.\s\-:]+(.+)$', line)
+        if match:
+            pos  = int(match.group(1))
+            name = match.group(2).strip()
+            if 1 <= pos <= 128 and name:
+                results.append({'position': pos, 'minecraft_nick': name})
+    return results
 
-        if points > 0:
-            conn.execute(
-                "INSERT INTO point_logs (user_id, event_id, points, position, reason, added_by, added_at) VALUES (?,?,?,?,?,?,?)",
-                (user['id'], event_id, points, pos, f'Posición #{pos}', session['admin_username'], now)
-            )
-            conn.execute(
-                "UPDATE users SET total_points=total_points+?, season_points=season_points+? WHERE id=?",
-                (points, points, user['id'])
-            )
-            assigned.append({'nick': nick, 'points': points, 'position': pos})
+def _get_ocr_pool():
+    global _ocr_pool, _ocr_pool_pid
+    from concurrent.futures import ProcessPoolExecutor
+    with _ocr_lock:
+        if _ocr_pool is None or _ocr_pool_pid != os.getpid():
+            _ocr_pool = ProcessPoolExecutor(max_workers=max(1, OCR_WORKERS))
+            _ocr_pool_pid = os.getpid()
+        return _ocr_pool
+
+def _ocr_cache_get(digest):
+    with _ocr_lock:
+        text = _ocr_cache.get(digest)
+        if text is not None:
+            _ocr_cache.move_to_end(digest)
+        return text
+
+def _ocr_cache_set(digest, text):
+    with _ocr_lock:
+        _ocr_cache[digest] = text
+        while len(_ocr_cache) > OCR_CACHE_SIZE:
+            _ocr_cache.popitem(last=False)
 
+def _save_ocr_job(job_id, status, result):
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn = get_db()
+    conn.execute(
+        "UPDATE ocr_jobs SET status=?, result=?, updated_at=? WHERE id=?",
+        (status, json.dumps(result), now, job_id)
+    )
     conn.commit()
     conn.close()
-    return jsonify({'assigned': assigned, 'not_found': not_found, 'already': already})
+
+def _ocr_job_result(images):
+    parsed, seen = [], set()
+    for item in images:
+        for r in item.get('parsed', []):
+            key = (r['position'], r['minecraft_nick'].lower())
+            if key not in seen:
+                seen.add(key)
+                parsed.append(r)
+    parsed.sort(key=lambda r: r['position'])
+    return {
+        'images': images,
+        'parsed': parsed,
+        'text':   '\n'.join(i.get('text', '') for i in images),
+    }
+
+def _ocr_image_done(job_id, index, digest, future):
+    job = _ocr_jobs[job_id]
+    try:
+        text = future.result()
+        _ocr_cache_set(digest, text)
+        job['images'][index].update(text=text, parsed=parse_ocr_text(text))
+    except ImportError:
+        job['images'][index]['error'] = 'Instala pytesseract y Tesseract-OCR para usar esta función.'
+    except Exception as e:
+        job['images'][index]['error'] = str(e)
+    with _ocr_lock:
+        job['pending'] -= 1
+        finished = job['pending'] == 0
+    if finished:
+        _finish_ocr_job(job_id)
+
+def _finish_ocr_job(job_id):
+    job = _ocr_jobs.pop(job_id)
+    images = job['images']
+    try:
+        status = 'error' if all('error' in i for i in images) else 'done'
+        result = _ocr_job_result(images)
+        # Corrige los errores típicos del OCR (0/O, l/I, _) contra el índice de nicks
+        conn = get_db()
+        index = nick_index(conn)
+        conn.close()
+        for r in result['parsed']:
+            user_id, real = index.resolve(r['minecraft_nick'])
+            if user_id is None:
+                r['candidates'] = index.candidates(r['minecraft_nick'])
+            elif real.lower() != r['minecraft_nick'].lower():
+                r['matched'] = real
+        _save_ocr_job(job_id, status, result)
+    except Exception as e:
+        # Corre en el callback del pool: sin esto el job quedaría 'pending' para siempre
+        print(f'[OCR] error al cerrar el job {job_id}: {e!r}')
+        _save_ocr_job(job_id, 'error', {'images': images, 'error': str(e)})
+
+def submit_ocr_job(conn, files, created_by):
+    """Crea el job, encola las imágenes que no estén en caché y devuelve su id."""
+    import uuid
+    job_id = uuid.uuid4().hex
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn.execute(
+        "INSERT INTO ocr_jobs (id, status, result, created_by, created_at, updated_at) VALUES (?,?,?,?,?,?)",
+        (job_id, 'pending', None, created_by, now, now)
+    )
+    conn.commit()
+
+    images, queued = [], []
+    for f in files:
+        data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        item = {'filename': f.filename, 'hash': digest}
+        text = _ocr_cache_get(digest)
+        if text is not None:
+            item.update(text=text, parsed=parse_ocr_text(text), cached=True)
+        else:
+            queued.append((len(images), digest, data))
+        images.append(item)
+
+    job = {'images': images, 'pending': len(queued)}
+    _ocr_jobs[job_id] = job
+    if not queued:
+        _finish_ocr_job(job_id)
+        return job_id
+    pool = _get_ocr_pool()
+    for index, digest, data in queued:
+        future = pool.submit(_ocr_image_bytes, data, OCR_BACKEND)
+        future.add_done_callback(lambda fut, i=index, d=digest: _ocr_image_done(job_id, i, d, fut))
+    return job_id
 
 @app.route('/admin/ocr_image', methods=['POST'])
 @admin_required
 def admin_ocr_image():
+    files = [f for f in request.files.getlist('images') + request.files.getlist('image') if f]
+    if not files:
+        return jsonify({'error': 'No se recibió imagen'}), 400
+    if len(files) > OCR_MAX_IMAGES:
+        return jsonify({'error': f'Máximo {OCR_MAX_IMAGES} imágenes por envío'}), 400
+    conn = get_db()
+    job_id = submit_ocr_job(conn, files, session['admin_username'])
+    conn.close()
+    return jsonify({'job_id': job_id, 'images': len(files)}), 202
+
+@app.route('/admin/ocr_jobs/<job_id>')
+@admin_required
+def admin_ocr_job(job_id):
+    conn = get_db()
+    job = conn.execute("SELECT * FROM ocr_jobs WHERE id=?", (job_id,)).fetchone()
+    conn.close()
+    if not job:
+        return jsonify({'error': 'Job no encontrado'}), 404
+    result = json.loads(job['result']) if job['result'] else {}
+    if job['status'] == 'error' and 'error' not in result:
+        result['error'] = '; '.join(sorted({i['error'] for i in result.get('images', []) if 'error' in i}))
+    return jsonify(dict(result, job_id=job_id, status=job['status']))
+
+# ─── IMPORTACIÓN DE RESULTADOS (CSV / XLSX) ───────────────────────────────────
+# El archivo subido se guarda en disco por bloques y un hilo de fondo lo lee
+# fila a fila (csv.reader o openpyxl en modo read-only), valida y va guardando
+# el progreso en import_jobs cada IMPORT_CHUNK_ROWS filas. Las filas válidas se
+# aplican al final con bulk_award en UNA transacción del escritor, con el id del
+# job como clave de idempotencia. El admin consulta /admin/import_jobs/<id>.
+
+IMPORT_WORKERS     = int(os.environ.get('IMPORT_WORKERS', '1'))
+IMPORT_CHUNK_ROWS  = 500
+IMPORT_MAX_ROWS    = 50000
+IMPORT_MAX_ERRORS  = 200
+IMPORT_POSITION_NAMES = {'position', 'posicion', 'posición', 'pos', 'puesto', 'rank', 'place', '#'}
+IMPORT_NICK_NAMES     = {'minecraft_nick', 'nick', 'minecraft', 'jugador', 'player', 'nombre', 'name'}
+
+_import_pool = None
+_import_pool_pid = None
+_import_lock = threading.Lock()
+
+def _get_import_pool():
+    global _import_pool, _import_pool_pid
+    from concurrent.futures import ThreadPoolExecutor
+    with _import_lock:
+        if _import_pool is None or _import_pool_pid != os.getpid():
+            _import_pool = ThreadPoolExecutor(max_workers=max(1, IMPORT_WORKERS), thread_name_prefix='import')
+            _import_pool_pid = os.getpid()
+        return _import_pool
+
+def import_file_rows(path, kind):
+    """Genera las filas del archivo como tuplas de celdas, sin cargarlo entero."""
+    if kind == 'xlsx':
+        from openpyxl import load_workbook
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            yield from wb.worksheets[0].iter_rows(values_only=True)
+        finally:
+            wb.close()
+        return
+    import csv
+    with open(path, newline='', encoding='utf-8-sig', errors='replace') as f:
+        try:
+            dialect = csv.Sniffer().sniff(f.read(4096), delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        f.seek(0)
+        yield from csv.reader(f, dialect)
+
+def _cell(row, idx):
+    return row[idx] if idx is not None and idx < len(row) and row[idx] is not None else ''
+
+def _column_index(spec, header):
+    """Columna pedida como nombre de cabecera, número (1 = primera) o letra (A, B...)."""
+    spec = str(spec).strip()
+    names = [str(h or '').strip().lower() for h in header]
+    if spec.lower() in names:
+        return names.index(spec.lower())
+    if spec.isdigit():
+        return int(spec) - 1 if int(spec) > 0 else None
+    if spec.isalpha() and len(spec) <= 2:
+        idx = 0
+        for ch in spec.upper():
+            idx = idx * 26 + ord(ch) - 64
+        return idx - 1
+    return None
+
+def map_import_columns(header, position_col=None, nick_col=None):
+    """
+    Devuelve (índice posición, índice nick, la primera fila es cabecera). Sin
+    columnas explícitas se buscan nombres conocidos en la primera fila; si no
+    hay cabecera se asume posición en la columna A y nick en la B.
+    """
+    names = [str(h or '').strip().lower() for h in header]
+    has_header = (any(n in IMPORT_POSITION_NAMES | IMPORT_NICK_NAMES for n in names)
+                  or any(str(c).strip().lower() in names for c in (position_col, nick_col) if c))
+
+    def find(spec, known, default):
+        if spec:
+            return _column_index(spec, header)
+        return next((i for i, n in enumerate(names) if n in known), None if has_header else default)
+
+    return find(position_col, IMPORT_POSITION_NAMES, 0), find(nick_col, IMPORT_NICK_NAMES, 1), has_header
+
+def parse_import_position(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value) if value == int(value) else None
+    text = str(value).strip().lstrip('#').rstrip('°º.').strip()
+    return int(text) if text.isdigit() else None
+
+def _save_import_job(job_id, status, **fields):
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    sets = ', '.join(f'{k}=?' for k in fields)
+    conn = get_db()
+    conn.execute(
+        f"UPDATE import_jobs SET status=?, updated_at=?{', ' + sets if sets else ''} WHERE id=?",
+        (status, now, *fields.values(), job_id)
+    )
+    conn.commit()
+    conn.close()
+
+def run_import_job(job_id, path, kind, event_id, position_col, nick_col, added_by):
+    """Hilo de fondo: lee, valida y aplica. El progreso queda en import_jobs."""
+    errors, results, seen = [], [], {}
+    error_count = rows_read = 0
+
+    def error(line, msg):
+        nonlocal error_count
+        error_count += 1
+        if len(errors) < IMPORT_MAX_ERRORS:
+            errors.append({'row': line, 'error': msg})
+
     try:
-        import pytesseract
-        from PIL import Image
-        import re
-
-        file = request.files.get('image')
-        if not file:
-            return jsonify({'error': 'No se recibió imagen'}), 400
-
-        img  = Image.open(file.stream)
-        text = pytesseract.image_to_string(img, lang='spa+eng')
-        lines   = text.strip().split('\n')
-        results = []
-        for line in lines:
-            line = line.strip()
-            if not line:
+        _save_import_job(job_id, 'parsing')
+        rows = import_file_rows(path, kind)
+        header = next(rows, None)
+        if header is None:
+            raise ValueError('El archivo está vacío')
+        pos_idx, nick_idx, has_header = map_import_columns(header, position_col, nick_col)
+        if pos_idx is None or nick_idx is None:
+            raise ValueError('No se encontraron las columnas de posición y nick')
+        first = [] if has_header else [header]
+        for line, row in enumerate(itertools.chain(first, rows), 2 if has_header else 1):
+            if not any(str(c).strip() for c in row if c is not None):
                 continue
-            match = re.match(r'^[#\.]?(\d+)[.\s\-:]+(.+)$', line)
-            if match:
-                pos  = int(match.group(1))
-                name = match.group(2).strip()
-                if 1 <= pos <= 128 and name:
-                    results.append({'position': pos, 'minecraft_nick': name})
-        return jsonify({'text': text, 'parsed': results})
-    except ImportError:
-        return jsonify({'error': 'Instala pytesseract y Tesseract-OCR para usar esta función.'}), 500
+            rows_read += 1
+            if rows_read > IMPORT_MAX_ROWS:
+                raise ValueError(f'Máximo {IMPORT_MAX_ROWS} filas por archivo')
+            pos  = parse_import_position(_cell(row, pos_idx))
+            nick = str(_cell(row, nick_idx)).strip()
+            if pos is None or pos < 1:
+                error(line, f'Posición inválida: {_cell(row, pos_idx)!r}')
+            elif not nick:
+                error(line, 'Nick vacío')
+            elif nick.lower() in seen:
+                error(line, f'Nick repetido (ya en la fila {seen[nick.lower()]})')
+            else:
+                seen[nick.lower()] = line
+                results.append({'position': pos, 'minecraft_nick': nick})
+            if rows_read % IMPORT_CHUNK_ROWS == 0:
+                _save_import_job(job_id, 'parsing', processed_rows=rows_read)
+
+        _save_import_job(job_id, 'applying', processed_rows=rows_read)
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        def job(conn):
+            response, gen, changes = bulk_award(conn, event_id, results, added_by, now, f'import:{job_id}')
+            if gen is not None:
+                WRITER.on_commit(gen, changes)
+            return response
+
+        response = WRITER.submit(job) if results else {'assigned': [], 'not_found': [], 'already': []}
+        result = dict(response, errors=errors, error_count=error_count, valid_rows=len(results))
+        _save_import_job(job_id, 'done', processed_rows=rows_read, result=json.dumps(result))
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        result = {'error': str(e), 'errors': errors, 'error_count': error_count}
+        _save_import_job(job_id, 'error', processed_rows=rows_read, result=json.dumps(result))
+    finally:
+        os.remove(path)
+
+@app.route('/admin/import_results', methods=['POST'])
+@admin_required
+def admin_import_results():
+    import tempfile, uuid
+    f = request.files.get('file')
+    event_id = request.form.get('event_id', type=int)
+    if not f or not f.filename or not event_id:
+        return jsonify({'error': 'Archivo y evento requeridos'}), 400
+    ext = f.filename.rsplit('.', 1)[-1].lower()
+    kind = {'csv': 'csv', 'txt': 'csv', 'tsv': 'csv', 'xlsx': 'xlsx', 'xlsm': 'xlsx'}.get(ext)
+    if not kind:
+        return jsonify({'error': 'Formato no soportado (usa CSV o XLSX)'}), 400
+
+    conn = get_db()
+    if not conn.execute("SELECT 1 FROM events WHERE id=?", (event_id,)).fetchone():
+        conn.close()
+        return jsonify({'error': 'Evento no encontrado'}), 404
+    job_id = uuid.uuid4().hex
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn.execute(
+        "INSERT INTO import_jobs (id, status, event_id, filename, processed_rows, created_by, created_at, updated_at) "
+        "VALUES (?,?,?,?,0,?,?,?)",
+        (job_id, 'pending', event_id, f.filename, session['admin_username'], now, now)
+    )
+    conn.commit()
+    conn.close()
+
+    # FileStorage.save copia por bloques: el archivo no pasa entero por memoria
+    fd, path = tempfile.mkstemp(suffix='.' + ext)
+    with os.fdopen(fd, 'wb') as dst:
+        f.save(dst)
+    _get_import_pool().submit(run_import_job, job_id, path, kind, event_id,
+                              request.form.get('position_col'), request.form.get('nick_col'),
+                              session['admin_username'])
+    return jsonify({'job_id': job_id}), 202
+
+@app.route('/admin/import_jobs/<job_id>')
+@admin_required
+def admin_import_job(job_id):
+    conn = get_db()
+    job = conn.execute("SELECT * FROM import_jobs WHERE id=?", (job_id,)).fetchone()
+    conn.close()
+    if not job:
+        return jsonify({'error': 'Job no encontrado'}), 404
+    result = json.loads(job['result']) if job['result'] else {}
+    return jsonify(dict(result, job_id=job_id, status=job['status'], filename=job['filename'],
+                        processed_rows=job['processed_rows']))
+
+# ─── EXPORTACIÓN ──────────────────────────────────────────────────────────────
+# El CSV se genera fila a fila desde el cursor y sale en bloques, sin armar el
+# archivo completo en memoria. El XLSX usa openpyxl en modo write-only, que
+# vuelca las filas a disco; el zip final se envía desde un archivo temporal.
+
+EXPORT_CHUNK_ROWS = 500
+EXPORT_HEADER = ['#', 'Usuario', 'Discord', 'Nick Minecraft', 'Puntos Totales', 'Puntos Temporada', 'Registro']
+
+def export_rows(conn, season_id=None, top=None):
+    """Itera las filas del ranking exportado. Con season_id ordena por los puntos de esa temporada."""
+    if season_id:
+        sql = '''
+            SELECT u.username, u.discord, u.minecraft_nick, u.total_points,
+                   SUM(pl.points) AS season_points, u.created_at
+            FROM point_logs pl
+            JOIN events e ON e.id = pl.event_id AND e.season = ?
+            JOIN users u ON u.id = pl.user_id
+            GROUP BY u.id
+            ORDER BY season_points DESC, u.id
+        '''
+        params = [season_id]
+    else:
+        sql = "SELECT username, discord, minecraft_nick, total_points, season_points, created_at FROM users ORDER BY total_points DESC, id"
+        params = []
+    if top:
+        sql += " LIMIT ?"
+        params.append(top)
+    cur = conn.execute(sql, params)
+    rank = 0
+    while True:
+        rows = cur.fetchmany(EXPORT_CHUNK_ROWS)
+        if not rows:
+            break
+        for u in rows:
+            rank += 1
+            yield [rank, u['username'], u['discord'], u['minecraft_nick'],
+                   u['total_points'], u['season_points'], u['created_at']]
+
+def _csv_chunks(rows):
+    import csv
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    buf.write('\ufeff')                   # BOM para que Excel detecte UTF-8
+    writer.writerow(EXPORT_HEADER)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % EXPORT_CHUNK_ROWS == 0:
+            yield buf.getvalue().encode('utf-8')
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode('utf-8')
+
+def _xlsx_file(rows):
+    import tempfile
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Ranking')
+    ws.append(EXPORT_HEADER)
+    for row in rows:
+        ws.append(row)
+    out = tempfile.TemporaryFile()
+    wb.save(out)
+    out.seek(0)
+    return out
 
 @app.route('/admin/export_ranking')
 @admin_required
 def admin_export_ranking():
-    import csv
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in ('csv', 'xlsx'):
+        return jsonify({'error': 'Formato no soportado (csv o xlsx)'}), 400
+    season_id = request.args.get('season', type=int)
+    top = request.args.get('top', type=int)
+    if top is not None and top <= 0:
+        return jsonify({'error': 'top debe ser mayor que 0'}), 400
+
+    name = f'ranking_{datetime.now().strftime("%Y%m%d_%H%M")}'
+    if season_id:
+        name += f'_t{season_id}'
+    if top:
+        name += f'_top{top}'
+
     conn = get_db()
-    users = conn.execute(
-        "SELECT username, discord, minecraft_nick, total_points, season_points, created_at FROM users ORDER BY total_points DESC"
-    ).fetchall()
-    conn.close()
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['#', 'Usuario', 'Discord', 'Nick Minecraft', 'Puntos Totales', 'Puntos Temporada', 'Registro'])
-    for i, u in enumerate(users, 1):
-        writer.writerow([i, u['username'], u['discord'], u['minecraft_nick'],
-                         u['total_points'], u['season_points'], u['created_at']])
-    output.seek(0)
-    return send_file(
-        io.BytesIO(output.getvalue().encode('utf-8-sig')),
-        mimetype='text/csv',
-        as_attachment=True,
-        download_name=f'ranking_{datetime.now().strftime("%Y%m%d_%H%M")}.csv'
-    )
+    rows = export_rows(conn, season_id, top)
+    if fmt == 'xlsx':
+        return send_file(
+            _xlsx_file(rows),
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            as_attachment=True,
+            download_name=f'{name}.xlsx'
+        )
+    resp = Response(stream_with_context(_csv_chunks(rows)), mimetype='text/csv')
+    resp.headers['Content-Disposition'] = f'attachment; filename={name}.csv'
+    return resp
 
 @app.route('/admin/get_events')
 @admin_required
@@ -562,14 +3117,30 @@ def admin_get_events():
 @admin_required
 def admin_delete_user():
     data    = request.json
-    user_id = data.get('user_id')
-    conn = get_db()
-    conn.execute("DELETE FROM point_logs WHERE user_id=?", (user_id,))
-    conn.execute("DELETE FROM users WHERE id=?", (user_id,))
-    conn.commit()
-    conn.close()
+    try:
+        user_id = int(data.get('user_id'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Datos incompletos'}), 400
+
+    def job(conn):
+        conn.execute("DELETE FROM point_logs WHERE user_id=?", (user_id,))
+        conn.execute("DELETE FROM users WHERE id=?", (user_id,))
+        WRITER.on_commit(bump_data_gen(conn), {user_id: None})
+
+    WRITER.submit(job)
     return jsonify({'success': True})
 
+@app.route('/admin/db_stats')
+@admin_required
+def admin_db_stats():
+    return jsonify(dict(pool_stats(), page_cache=PAGE_CACHE.stats(), writer=dict(WRITER.stats),
+                        snapshot=SNAPSHOT.info()))
+
+@app.route('/admin/metrics')
+@admin_required
+def admin_metrics():
+    return Response(metrics_text(), mimetype='text/plain; version=0.0.4')
+
 # ─── TEMPORADAS ───────────────────────────────────────────────────────────────
 
 @app.route('/admin/seasons')
@@ -578,7 +3149,7 @@ def admin_seasons():
     conn = get_db()
     seasons = conn.execute("SELECT * FROM seasons ORDER BY id DESC").fetchall()
     active  = conn.execute("SELECT * FROM seasons WHERE is_active=1 ORDER BY id DESC LIMIT 1").fetchone()
-    total_users = conn.execute("SELECT COUNT(*) as c FROM users").fetchone()['c']
+    total_users, = read_stats(conn, 'users')
     conn.close()
     return render_template('seasons.html',
         seasons=seasons, active=active,
@@ -593,31 +3164,85 @@ def admin_season_create():
     if not name:
         return jsonify({'error': 'El nombre es requerido'}), 400
     now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    conn = get_db()
-    cur = conn.execute(
-        "INSERT INTO seasons (name, start_date, is_active) VALUES (?,?,0)",
-        (name, now)
-    )
-    conn.commit()
-    season_id = cur.lastrowid
-    conn.close()
+
+    def job(conn):
+        cur = conn.execute(
+            "INSERT INTO seasons (name, start_date, is_active) VALUES (?,?,0)",
+            (name, now)
+        )
+        WRITER.on_commit(bump_data_gen(conn))
+        return cur.lastrowid
+
+    season_id = WRITER.submit(job)
     return jsonify({'success': True, 'id': season_id, 'name': name})
 
+# Los ajustes sin evento son de la temporada activa cuando se cargaron
+# (SEASON_OF_LOG), así que cambiar fechas o la temporada activa puede moverlos.
+# season_change() los descuenta de los agregados por temporada antes del cambio
+# y los vuelve a sumar después; los logs con evento no se recorren.
+MANUAL_SEASON_LOGS = (f"SELECT {SEASON_OF_LOG.format(r='pl')} AS s, pl.user_id, pl.points "
+                      "FROM point_logs pl WHERE pl.event_id IS NULL")
+
+def _add_manual_season_totals(conn, sign):
+    conn.execute(f'''INSERT INTO stats (key, value)
+        SELECT 'season_points:' || s, {sign}SUM(points) FROM ({MANUAL_SEASON_LOGS}) WHERE s IS NOT NULL GROUP BY s
+        ON CONFLICT(key) DO UPDATE SET value = value + excluded.value''')
+    conn.execute(f'''INSERT INTO rollups (dim, bucket, user_id, points, entries)
+        SELECT 'season', CAST(s AS TEXT), user_id, {sign}SUM(points), {sign}COUNT(*) FROM ({MANUAL_SEASON_LOGS})
+        WHERE s IS NOT NULL GROUP BY s, user_id
+        ON CONFLICT(dim, bucket, user_id) DO UPDATE SET points = points + excluded.points, entries = entries + excluded.entries''')
+    conn.execute("DELETE FROM rollups WHERE dim = 'season' AND entries = 0")
+
+@contextmanager
+def season_change(conn):
+    _add_manual_season_totals(conn, '-')
+    yield
+    _add_manual_season_totals(conn, '')
+
 @app.route('/admin/seasons/activate', methods=['POST'])
 @admin_required
 def admin_season_activate():
     """Activa una temporada (no resetea puntos todavía)"""
     data = request.json
     season_id = data.get('season_id')
-    conn = get_db()
-    # Desactivar todas
-    conn.execute("UPDATE seasons SET is_active=0")
-    # Activar la seleccionada
-    conn.execute("UPDATE seasons SET is_active=1 WHERE id=?", (season_id,))
-    conn.commit()
-    conn.close()
+
+    def job(conn):
+        with season_change(conn):
+            # Desactivar todas
+            conn.execute("UPDATE seasons SET is_active=0")
+            # Activar la seleccionada
+            conn.execute("UPDATE seasons SET is_active=1 WHERE id=?", (season_id,))
+        WRITER.on_commit(bump_data_gen(conn))
+
+    WRITER.submit(job)
     return jsonify({'success': True})
 
+# Puntos de la temporada :season calculados desde point_logs con SEASON_OF_LOG:
+# los de sus eventos más los ajustes sin evento cargados mientras estaba activa
+SEASON_POINTS_SQL = f'''
+    SELECT u.id AS user_id, u.username, u.discord, u.minecraft_nick,
+           SUM(pl.points) AS season_points, u.total_points
+    FROM (SELECT pl.user_id, pl.points FROM events e JOIN point_logs pl ON pl.event_id = e.id
+          WHERE e.season = :season
+          UNION ALL
+          SELECT pl.user_id, pl.points FROM point_logs pl
+          WHERE pl.event_id IS NULL AND ({SEASON_OF_LOG.format(r='pl')}) = :season) pl
+    JOIN users u ON u.id = pl.user_id
+    GROUP BY u.id
+    HAVING SUM(pl.points) > 0
+    ORDER BY season_points DESC, u.id
+'''
+
+def save_season_standings(conn, season_id):
+    conn.execute("DELETE FROM season_standings WHERE season_id=?", (season_id,))
+    return conn.execute(f'''
+        INSERT INTO season_standings
+            (season_id, position, user_id, username, discord, minecraft_nick, season_points, total_points)
+        SELECT :season, ROW_NUMBER() OVER (ORDER BY season_points DESC, user_id),
+               user_id, username, discord, minecraft_nick, season_points, total_points
+        FROM ({SEASON_POINTS_SQL})
+    ''', {'season': season_id}).rowcount
+
 @app.route('/admin/seasons/end', methods=['POST'])
 @admin_required
 def admin_season_end():
@@ -633,25 +3258,26 @@ def admin_season_end():
     new_season_id = data.get('new_season_id')
 
     now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    conn = get_db()
 
-    # Guardar snapshot en point_logs como registro histórico
-    users = conn.execute(
-        "SELECT id, username, season_points FROM users WHERE season_points > 0"
-    ).fetchall()
+    def job(conn):
+        # Guardar la clasificación final en season_standings (un solo INSERT)
+        save_season_standings(conn, current_id)
 
-    conn.execute("UPDATE seasons SET is_active=0, end_date=? WHERE id=?", (now, current_id))
+        with season_change(conn):
+            conn.execute("UPDATE seasons SET is_active=0, end_date=? WHERE id=?", (now, current_id))
+            # Activar nueva temporada si se especificó
+            if new_season_id:
+                conn.execute("UPDATE seasons SET is_active=1, start_date=? WHERE id=?", (now, new_season_id))
 
-    # Resetear puntos de temporada
-    conn.execute("UPDATE users SET season_points=0")
+        # Resetear puntos de temporada
+        players_reset = conn.execute("UPDATE users SET season_points=0 WHERE season_points != 0").rowcount
 
-    # Activar nueva temporada si se especificó
-    if new_season_id:
-        conn.execute("UPDATE seasons SET is_active=1, start_date=? WHERE id=?", (now, new_season_id))
+        # Solo cambian los puntos de temporada: el orden por total_points no se mueve
+        WRITER.on_commit(bump_data_gen(conn))
+        return players_reset
 
-    conn.commit()
-    conn.close()
-    return jsonify({'success': True, 'players_reset': len(users)})
+    players_reset = WRITER.submit(job)
+    return jsonify({'success': True, 'players_reset': players_reset})
 
 @app.route('/admin/seasons/reset_all', methods=['POST'])
 @admin_required
@@ -662,11 +3288,27 @@ def admin_season_reset_all():
     if confirm != 'RESET':
         return jsonify({'error': 'Confirmación incorrecta'}), 400
 
-    conn = get_db()
-    conn.execute("UPDATE users SET season_points=0, total_points=0")
-    conn.execute("DELETE FROM point_logs")
-    conn.commit()
-    conn.close()
+
+    def job(conn):
+        conn.execute("UPDATE users SET season_points=0, total_points=0")
+        # Sin disparar los triggers por fila de point_logs: se quitan mientras se
+        # vacía la tabla y las tablas derivadas se limpian de una vez
+        triggers = conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'point_logs'"
+        ).fetchall()
+        for name, _ in triggers:
+            conn.execute(f"DROP TRIGGER {name}")
+        conn.execute("DELETE FROM point_logs")
+        for _, sql in triggers:
+            conn.execute(sql)
+        conn.execute("DELETE FROM rollups")
+        conn.execute("DELETE FROM rank_history")
+        conn.execute("DELETE FROM point_log_tombstones")
+        conn.execute("DELETE FROM reconcile_ledger")     # sumas hasta reconcile_log_id: ya no queda ningún log
+        conn.execute("UPDATE stats SET value = 0 WHERE key IN ('points', 'point_logs') OR key LIKE 'season_points:%'")
+        WRITER.on_commit(bump_data_gen(conn), reset=True)
+
+    WRITER.submit(job)
     return jsonify({'success': True})
 
 @app.route('/admin/seasons/stats/<int:season_id>')
@@ -674,22 +3316,812 @@ def admin_season_reset_all():
 def admin_season_stats(season_id):
     conn = get_db()
     season = conn.execute("SELECT * FROM seasons WHERE id=?", (season_id,)).fetchone()
-    # Top jugadores por puntos de temporada
-    top = conn.execute(
-        "SELECT username, discord, minecraft_nick, season_points, total_points FROM users ORDER BY season_points DESC LIMIT 20"
-    ).fetchall()
+    archived = conn.execute(
+        "SELECT 1 FROM season_standings WHERE season_id=? LIMIT 1", (season_id,)
+    ).fetchone()
+    if season and season['end_date'] and archived:
+        # Temporada cerrada: lectura directa de la clasificación guardada
+        top = conn.execute(
+            "SELECT username, discord, minecraft_nick, season_points, total_points FROM season_standings WHERE season_id=? ORDER BY position LIMIT 20",
+            (season_id,)
+        ).fetchall()
+        total_pts = conn.execute(
+            "SELECT SUM(season_points) as s FROM season_standings WHERE season_id=?", (season_id,)
+        ).fetchone()['s'] or 0
+    else:
+        top = conn.execute(SEASON_POINTS_SQL + " LIMIT 20", {'season': season_id}).fetchall()
+        total_pts, = read_stats(conn, f'season_points:{season_id}')
     events = conn.execute(
         "SELECT * FROM events WHERE season=? ORDER BY event_date DESC", (season_id,)
     ).fetchall()
-    total_pts = conn.execute("SELECT SUM(season_points) as s FROM users").fetchone()['s'] or 0
     conn.close()
     return jsonify({
         'season': dict(season) if season else {},
         'top': [dict(u) for u in top],
         'events': [dict(e) for e in events],
-        'total_pts': total_pts
+        'total_pts': total_pts,
+        'archived': bool(archived)
     })
 
+# ─── ESCALAS DE PUNTOS Y RE-PUNTUACIÓN ────────────────────────────────────────
+# Cada evento o temporada puede tener su escala (scoring_scales.points es una
+# lista JSON: posición 1, 2, ...). rescore_points recalcula point_logs.points
+# desde position para todos los logs de un evento o temporada con NumPy: una
+# matriz escala × posición y un solo indexado para todas las filas. En modo
+# dry_run devuelve el ranking resultante sin escribir nada.
+
+SCALE_MAX_POSITIONS = 1000
+RESCORE_TOP = 20
+
+def _parse_scale(raw):
+    if not isinstance(raw, list) or not 0 < len(raw) <= SCALE_MAX_POSITIONS:
+        return None
+    try:
+        points = [int(p) for p in raw]
+    except (TypeError, ValueError):
+        return None
+    return points if all(p >= 0 for p in points) else None
+
+def rescore_frame(conn, season_id=None, event_id=None):
+    """
+    DataFrame con los logs afectados (id, user_id, points, new_points, in_season).
+    Solo cuentan los logs con evento y posición; los ajustes manuales no cambian.
+    """
+    import numpy as np
+    import pandas as pd
+    active = conn.execute("SELECT id FROM seasons WHERE is_active=1 ORDER BY id DESC LIMIT 1").fetchone()
+    scope, param = ("e.id = ?", event_id) if event_id else ("e.season = ?", season_id)
+    df = pd.read_sql_query(f'''
+        SELECT pl.id, pl.user_id, pl.points, pl.position,
+               COALESCE(e.scale_id, s.scale_id, 0) AS scale_id,
+               e.season = ? AS in_season
+        FROM point_logs pl
+        JOIN events e ON e.id = pl.event_id
+        LEFT JOIN seasons s ON s.id = e.season
+        WHERE {scope} AND pl.position IS NOT NULL
+    ''', conn, params=(active['id'] if active else None, param))
+
+    # Fila 0 = escala por defecto; columna p = puntos de la posición p (0 fuera de la tabla)
+    scales = {0: DEFAULT_SCALE}
+    for r in conn.execute("SELECT id, points FROM scoring_scales"):
+        scales[r['id']] = json.loads(r['points'])
+    keys = np.array(sorted(scales))
+    width = max(len(p) for p in scales.values()) + 1
+    table = np.zeros((len(keys), width), dtype=np.int64)
+    for i, k in enumerate(keys):
+        table[i, 1:len(scales[k]) + 1] = scales[k]
+
+    pos = df['position'].to_numpy(dtype=np.int64)
+    row = np.searchsorted(keys, df['scale_id'].to_numpy(dtype=np.int64))
+    inside = (pos >= 1) & (pos < width)
+    df['new_points'] = np.where(inside, table[row, np.clip(pos, 0, width - 1)], 0)
+    df['in_season'] = df['in_season'].fillna(0).astype(bool)
+    return df
+
+def rescore_deltas(df):
+    """Cambios por jugador: DataFrame indexado por user_id con delta y season_delta."""
+    changed = df[df['new_points'] != df['points']]
+    delta = changed['new_points'] - changed['points']
+    return changed, (changed.assign(delta=delta, season_delta=delta.where(changed['in_season'], 0))
+                     .groupby('user_id')[['delta', 'season_delta']].sum())
+
+def whatif_leaderboard(conn, deltas, top=RESCORE_TOP):
+    """Ranking completo con los totales nuevos; devuelve los primeros `top`."""
+    import pandas as pd
+    users = pd.read_sql_query(
+        "SELECT id, username, minecraft_nick, total_points FROM users", conn, index_col='id'
+    )
+    users['new_total'] = users['total_points'].add(deltas['delta'], fill_value=0).astype('int64')
+    old = users.reset_index().sort_values(['total_points', 'id'], ascending=[False, True])
+    new = users.reset_index().sort_values(['new_total', 'id'], ascending=[False, True])
+    old_rank = dict(zip(old['id'], range(1, len(old) + 1)))
+    board = new.head(top)
+    return [{'id': int(r.id), 'username': r.username, 'minecraft_nick': r.minecraft_nick,
+             'total_points': int(r.total_points), 'new_total': int(r.new_total),
+             'old_rank': old_rank[r.id], 'new_rank': i}
+            for i, r in enumerate(board.itertuples(), 1)]
+
+def rescore_points(conn, season_id=None, event_id=None, dry_run=False, top=RESCORE_TOP):
+    """
+    Re-puntúa los logs del evento/temporada. Con dry_run=False escribe los
+    puntos y los totales de users en la transacción actual (un job del escritor).
+    """
+    df = rescore_frame(conn, season_id, event_id)
+    changed, deltas = rescore_deltas(df)
+    report = {
+        'scope': {'event_id': event_id} if event_id else {'season_id': season_id},
+        'logs': len(df),
+        'changed_logs': len(changed),
+        'users_affected': len(deltas),
+        'points_delta': int(deltas['delta'].sum()),
+        'dry_run': dry_run,
+    }
+    if dry_run:
+        report['leaderboard'] = whatif_leaderboard(conn, deltas, top)
+        return report, None, {}
+    if changed.empty:
+        return report, None, {}
+
+    ids = deltas.index.tolist()
+    before = user_totals(conn, ids)
+    conn.executemany(
+        "UPDATE point_logs SET points=? WHERE id=?",
+        zip(changed['new_points'].tolist(), changed['id'].tolist())
+    )
+    conn.executemany(
+        "UPDATE users SET total_points=total_points+?, season_points=season_points+? WHERE id=?",
+        zip(deltas['delta'].tolist(), deltas['season_delta'].tolist(), ids)
+    )
+    # La conciliación incremental supone logs inmutables: la próxima es completa
+    conn.execute("DELETE FROM app_state WHERE key = 'reconcile_log_id'")
+    changes = user_totals(conn, ids)
+    gen = bump_data_gen(conn)
+    record_point_deltas(conn, gen, before, changes)
+    return report, gen, changes
+
+@app.route('/admin/scales', methods=['GET', 'POST'])
+@admin_required
+def admin_scales():
+    if request.method == 'GET':
+        conn = get_db()
+        rows = conn.execute("SELECT * FROM scoring_scales ORDER BY id").fetchall()
+        conn.close()
+        return jsonify({'default': DEFAULT_SCALE,
+                        'scales': [dict(r, points=json.loads(r['points'])) for r in rows]})
+    data   = request.json
+    name   = (data.get('name') or '').strip()
+    points = _parse_scale(data.get('points'))
+    if not name or points is None:
+        return jsonify({'error': 'Nombre y lista de puntos (enteros >= 0) requeridos'}), 400
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    created_by = session['admin_username']
+
+    def job(conn):
+        return conn.execute(
+            "INSERT INTO scoring_scales (name, points, created_by, created_at) VALUES (?,?,?,?)",
+            (name, json.dumps(points), created_by, now)
+        ).lastrowid
+
+    try:
+        scale_id = WRITER.submit(job)
+    except sqlite3.IntegrityError:
+        return jsonify({'error': 'Ya existe una escala con ese nombre'}), 409
+    return jsonify({'success': True, 'id': scale_id})
+
+@app.route('/admin/scales/assign', methods=['POST'])
+@admin_required
+def admin_scale_assign():
+    """Asigna (o quita, con scale_id null) la escala de un evento o temporada."""
+    data     = request.json
+    scale_id = data.get('scale_id')
+    if data.get('event_id'):
+        table, target = 'events', data['event_id']
+    elif data.get('season_id'):
+        table, target = 'seasons', data['season_id']
+    else:
+        return jsonify({'error': 'Indica event_id o season_id'}), 400
+
+    def job(conn):
+        if scale_id is not None and not conn.execute("SELECT 1 FROM scoring_scales WHERE id=?", (scale_id,)).fetchone():
+            return 0
+        return conn.execute(f"UPDATE {table} SET scale_id=? WHERE id=?", (scale_id, target)).rowcount
+
+    if not WRITER.submit(job):
+        return jsonify({'error': 'Escala o destino no encontrado'}), 404
+    return jsonify({'success': True})
+
+@app.route('/admin/rescore', methods=['POST'])
+@admin_required
+def admin_rescore():
+    data      = request.json or {}
+    season_id = data.get('season_id')
+    event_id  = data.get('event_id')
+    if not season_id and not event_id:
+        return jsonify({'error': 'Indica event_id o season_id'}), 400
+    try:
+        top = max(1, min(int(data.get('top', RESCORE_TOP)), RANKING_MAX_PAGE))
+    except (TypeError, ValueError):
+        top = RESCORE_TOP
+
+    if data.get('dry_run'):
+        conn = get_db()
+        conn.execute("BEGIN")                     # una sola instantánea de lectura
+        try:
+            report, _, _ = rescore_points(conn, season_id, event_id, dry_run=True, top=top)
+        finally:
+            conn.rollback()
+            conn.close()
+        return jsonify(report)
+
+    def job(conn):
+        report, gen, changes = rescore_points(conn, season_id, event_id)
+        if gen is not None:
+            WRITER.on_commit(gen, changes)
+        return report
+
+    return jsonify(WRITER.submit(job))
+
+# ─── CONCILIACIÓN ─────────────────────────────────────────────────────────────
+# Recalcula total_points y season_points desde point_logs y reporta las
+# diferencias con los contadores de users. reconcile_ledger guarda las sumas
+# por jugador hasta el último point_logs.id revisado; la siguiente corrida solo
+# suma los logs nuevos y resta los borrados (point_log_tombstones). Si cambió
+# la temporada activa, o con full=True, se recalcula todo en un único GROUP BY.
+# Las correcciones se aplican como deltas en lotes, sin pisar escrituras
+# concurrentes. La lectura usa la conexión del llamador; el punto de control y
+# cada lote de correcciones son jobs del escritor.
+
+RECONCILE_BATCH = 1000
+
+# Un log cuenta para la temporada activa según SEASON_OF_LOG
+_IN_SEASON_SQL = f"(({SEASON_OF_LOG.format(r='pl')}) = :season)"
+
+def _reconcile_state(conn):
+    rows = conn.execute(
+        "SELECT key, value FROM app_state WHERE key IN ('reconcile_log_id', 'reconcile_tomb_id', 'reconcile_season')"
+    ).fetchall()
+    return {r['key']: r['value'] for r in rows}
+
+def reconcile_points(conn, apply=False, full=False, batch_size=RECONCILE_BATCH, report_limit=100):
+    """Verifica (y con apply=True corrige) los contadores de puntos de users."""
+    active = conn.execute("SELECT id FROM seasons WHERE is_active=1 ORDER BY id DESC LIMIT 1").fetchone()
+    # Sin temporada activa ningún log cuenta como "de temporada" (= NULL nunca es verdadero)
+    season = {'season': active['id'] if active else None}
+
+    conn.execute("BEGIN")                     # una sola instantánea de lectura
+    try:
+        state    = _reconcile_state(conn)
+        last_log = state.get('reconcile_log_id')
+        last_tmb = state.get('reconcile_tomb_id', 0)
+        full = full or last_log is None or state.get('reconcile_season') != season['season']
+        max_log = conn.execute("SELECT COALESCE(MAX(id), 0) FROM point_logs").fetchone()[0]
+        max_tmb = conn.execute("SELECT COALESCE(MAX(id), 0) FROM point_log_tombstones").fetchone()[0]
+
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS recon_agg (user_id INTEGER PRIMARY KEY, total_points INTEGER, season_points INTEGER)")
+        conn.execute("DELETE FROM temp.recon_agg")
+        if full:
+            scanned = conn.execute("SELECT COUNT(*) FROM point_logs").fetchone()[0]
+            conn.execute(f'''
+                INSERT INTO temp.recon_agg (user_id, total_points, season_points)
+                SELECT pl.user_id, SUM(pl.points), SUM(CASE WHEN {_IN_SEASON_SQL} THEN pl.points ELSE 0 END)
+                FROM point_logs pl
+                WHERE pl.id <= :max_log
+                GROUP BY pl.user_id
+            ''', dict(season, max_log=max_log))
+        else:
+            params = dict(season, last_log=last_log, max_log=max_log, last_tmb=last_tmb, max_tmb=max_tmb)
+            scanned = conn.execute(
+                "SELECT COUNT(*) FROM point_logs WHERE id > :last_log AND id <= :max_log", params
+            ).fetchone()[0]
+            conn.execute(f'''
+                INSERT INTO temp.recon_agg (user_id, total_points, season_points)
+                SELECT user_id, SUM(t), SUM(s) FROM (
+                    SELECT user_id, total_points AS t, season_points AS s FROM reconcile_ledger
+                    UNION ALL
+                    SELECT pl.user_id, pl.points, CASE WHEN {_IN_SEASON_SQL} THEN pl.points ELSE 0 END
+                    FROM point_logs pl
+                    WHERE pl.id > :last_log AND pl.id <= :max_log
+                    UNION ALL
+                    SELECT pl.user_id, -pl.points, CASE WHEN {_IN_SEASON_SQL} THEN -pl.points ELSE 0 END
+                    FROM point_log_tombstones pl
+                    WHERE pl.id > :last_tmb AND pl.id <= :max_tmb AND pl.log_id <= :last_log
+                ) GROUP BY user_id
+            ''', params)
+
+        diffs = [dict(r) for r in conn.execute('''
+            SELECT u.id AS user_id, u.username, u.total_points, u.season_points,
+                   COALESCE(a.total_points, 0) AS expected_total,
+                   COALESCE(a.season_points, 0) AS expected_season
+            FROM users u LEFT JOIN temp.recon_agg a ON a.user_id = u.id
+            WHERE u.total_points IS NOT COALESCE(a.total_points, 0)
+               OR u.season_points IS NOT COALESCE(a.season_points, 0)
+            ORDER BY u.id
+        ''')]
+        users_checked = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        ledger = conn.execute("SELECT user_id, total_points, season_points FROM temp.recon_agg").fetchall()
+        conn.execute("DELETE FROM temp.recon_agg")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    # Nuevo punto de control (las escrituras van por el escritor del worker)
+    def checkpoint(wconn):
+        wconn.execute("DELETE FROM reconcile_ledger")
+        wconn.executemany("INSERT INTO reconcile_ledger (user_id, total_points, season_points) VALUES (?, ?, ?)",
+                          [tuple(r) for r in ledger])
+        wconn.execute("DELETE FROM point_log_tombstones WHERE id <= ?", (max_tmb,))
+        wconn.executemany(
+            "INSERT INTO app_state (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            [('reconcile_log_id', max_log), ('reconcile_tomb_id', max_tmb), ('reconcile_season', season['season'])]
+        )
+    WRITER.submit(checkpoint)
+
+    def apply_batch(wconn, batch):
+        wconn.executemany(
+            "UPDATE users SET total_points = total_points + ?, season_points = season_points + ? WHERE id = ?",
+            [(d['expected_total'] - d['total_points'], d['expected_season'] - d['season_points'], d['user_id'])
+             for d in batch]
+        )
+        changes = user_totals(wconn, [d['user_id'] for d in batch])
+        WRITER.on_commit(bump_data_gen(wconn), changes)
+
+    fixed = 0
+    if apply:
+        for i in range(0, len(diffs), batch_size):
+            batch = diffs[i:i + batch_size]
+            WRITER.submit(lambda wconn: apply_batch(wconn, batch))
+            fixed += len(batch)
+
+    return {
+        'mode': 'full' if full else 'incremental',
+        'scanned_logs': scanned,
+        'users_checked': users_checked,
+        'checkpoint_log_id': max_log,
+        'diff_count': len(diffs),
+        'diffs': diffs[:report_limit],
+        'fixed': fixed,
+    }
+
+@app.route('/admin/reconcile', methods=['POST'])
+@admin_required
+def admin_reconcile():
+    data = request.json or {}
+    conn = get_db()
+    report = reconcile_points(conn, apply=bool(data.get('apply')), full=bool(data.get('full')))
+    conn.close()
+    return jsonify(report)
+
+@app.cli.command('reconcile')
+@click.option('--apply', is_flag=True, help='Corrige los contadores con diferencias.')
+@click.option('--full', is_flag=True, help='Ignora el punto de control y recalcula todo.')
+@click.option('--batch-size', default=RECONCILE_BATCH, show_default=True)
+def reconcile_command(apply, full, batch_size):
+    """Verifica total_points/season_points contra point_logs."""
+    conn = get_db()
+    report = reconcile_points(conn, apply=apply, full=full, batch_size=batch_size, report_limit=None)
+    conn.close()
+    for d in report['diffs']:
+        print(f"  #{d['user_id']} {d['username']}: total {d['total_points']} → {d['expected_total']}, "
+              f"temporada {d['season_points']} → {d['expected_season']}")
+    print(f"[RECONCILE] {report['mode']}: {report['scanned_logs']} logs revisados, "
+          f"{report['diff_count']} diferencias, {report['fixed']} corregidas")
+
+@app.cli.command('migrate-db')
+def migrate_db_command():
+    """Aplica las migraciones pendientes a ranking.db y ranking_prefab.db."""
+    for path in (PREFAB_PATH, DB_PATH):
+        if os.path.exists(path):
+            applied = migrate_db(path)
+            print(f'[DB] {path}: versión {SCHEMA_VERSION}' + ('' if applied else ' (sin cambios)'))
+
+# ─── ARRANQUE ─────────────────────────────────────────────────────────────────
+# create_app() prepara la base (ensure_db + migraciones) y calienta las cachés
+# una sola vez por proceso. Con `gunicorn --preload 'app:create_app()'` corre en
+# el master antes del fork: los workers nacen con el índice de rangos, el de
+# nicks y las plantillas ya compiladas. PIL, pytesseract, pandas y openpyxl se
+# importan solo dentro de OCR/importación/exportación; STARTUP['eager_modules']
+# avisa si alguno se coló en el arranque. (csv no se vigila: lo carga Flask.)
+
+LAZY_MODULES = ('PIL', 'pytesseract', 'pandas', 'numpy', 'openpyxl')
+STARTUP = {'import_ms': None, 'db_ms': None, 'warm_ms': None,
+           'first_request_ms': None, 'first_request_endpoint': None, 'eager_modules': []}
+
+_startup_lock = threading.Lock()
+_app_ready    = False
+
+def warm_up():
+    """Carga los índices en memoria y la generación de datos, y compila las plantillas."""
+    conn = get_db()
+    rank_index(conn)
+    nick_index(conn)
+    conn.close()
+    data_generation()
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    # El master no se queda con conexiones abiertas a través del fork
+    close_db_pool()
+
+def create_app(db_path=None):
+    """Prepara la base y las cachés (una vez) y devuelve la app."""
+    global DB_PATH, _app_ready
+    with _startup_lock:
+        if db_path:
+            DB_PATH = db_path
+        if not _app_ready:
+            start = time.perf_counter()
+            ensure_db()
+            STARTUP['db_ms'] = round((time.perf_counter() - start) * 1000, 2)
+            start = time.perf_counter()
+            warm_up()
+            STARTUP['warm_ms'] = round((time.perf_counter() - start) * 1000, 2)
+            STARTUP['eager_modules'] = [m for m in LAZY_MODULES if m in sys.modules]
+            _app_ready = True
+            print(f"[STARTUP] import {STARTUP['import_ms']} ms, db {STARTUP['db_ms']} ms, "
+                  f"warm-up {STARTUP['warm_ms']} ms"
+                  + (f", cargados al arrancar: {', '.join(STARTUP['eager_modules'])}"
+                     if STARTUP['eager_modules'] else ''))
+    return app
+
+# ─── DATOS SINTÉTICOS Y BENCHMARK ─────────────────────────────────────────────
+# gen-data crea una base con el esquema real y el tamaño que se pida (usuarios,
+# eventos, point_logs, temporadas). bench recorre las rutas principales con el
+# test client de Flask y guarda p50/p99, consultas SQL y memoria pico en JSON
+# para comparar entre ejecuciones. bench escribe en la base (bulk_points): úsalo
+# sobre una copia.
+
+GEN_BATCH   = 50000
+GEN_START   = datetime(2023, 1, 1)
+GEN_DAYS    = 730
+MANUAL_LOGS = 0.1      # fracción de point_logs sin evento (ajustes manuales)
+
+def generate_synthetic_db(path, users=100000, events=10000, logs=5000000, seasons=4, seed=1):
+    """
+    Crea `path` desde cero con datos coherentes: cada evento tiene participantes
+    únicos ordenados por habilidad (+ ruido) y puntos de get_pts(); los totales
+    de users cuadran con point_logs. Devuelve los tamaños generados.
+    """
+    import random
+    from datetime import timedelta
+    rng = random.Random(seed)
+    init_db_fresh(path)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    fmt = '%Y-%m-%d %H:%M:%S'
+
+    # Temporadas: la última queda activa
+    conn.execute("DELETE FROM seasons")
+    season_len = GEN_DAYS // seasons
+    season_rows = []
+    for s in range(1, seasons + 1):
+        start = GEN_START + timedelta(days=(s - 1) * season_len)
+        end = None if s == seasons else (start + timedelta(days=season_len)).strftime(fmt)
+        season_rows.append((s, f'Temporada {s}', start.strftime(fmt), end, int(s == seasons)))
+    conn.executemany("INSERT INTO seasons (id, name, start_date, end_date, is_active) VALUES (?,?,?,?,?)", season_rows)
+    active_start = season_rows[-1][2]
+
+    pw = hash_pw('secret1')
+    conn.executemany(
+        "INSERT INTO users (id, username, password, discord, minecraft_nick, created_at) VALUES (?,?,?,?,?,?)",
+        ((i, f'player{i}', pw, f'player{i}#{i % 10000:04d}', f'{rng.choice(("Mc", "Pro", "xX", "Steve", "Alex"))}_{i}', now)
+         for i in range(1, users + 1))
+    )
+    skill = [0.0] + [rng.gauss(0, 1) for _ in range(users)]
+    total = [0] * (users + 1)
+    season_pts = [0] * (users + 1)
+
+    event_logs = int(logs * (1 - MANUAL_LOGS)) if events else 0
+    per_event = min(users, max(1, event_logs // events)) if events else 0
+    batch, written = [], 0
+
+    def flush():
+        conn.executemany(
+            "INSERT INTO point_logs (user_id, event_id, points, position, reason, added_by, added_at) VALUES (?,?,?,?,?,?,?)",
+            batch
+        )
+        batch.clear()
+
+    for e in range(1, events + 1):
+        when = GEN_START + timedelta(minutes=e * GEN_DAYS * 1440 // events)
+        season = min(seasons, (when - GEN_START).days // season_len + 1)
+        stamp = when.strftime(fmt)
+        conn.execute(
+            "INSERT INTO events (id, name, event_date, description, created_by, created_at, season) VALUES (?,?,?,?,?,?,?)",
+            (e, f'Evento {e}', when.strftime('%Y-%m-%d'), '', 'admin1', stamp, season)
+        )
+        players = rng.sample(range(1, users + 1), per_event)
+        players.sort(key=lambda uid: -(skill[uid] + rng.gauss(0, 1)))
+        for pos, uid in enumerate(players, 1):
+            pts = get_pts(pos)
+            batch.append((uid, e, pts, pos, f'Evento {e} - Pos #{pos}', 'admin1', stamp))
+            total[uid] += pts
+            if season == seasons:
+                season_pts[uid] += pts
+        written += per_event
+        if len(batch) >= GEN_BATCH:
+            flush()
+
+    span = GEN_DAYS * 86400
+    for n in range(max(0, logs - written)):
+        uid = rng.randint(1, users)
+        pts = rng.choice((1, 2, 5, 10, -5))
+        when = (GEN_START + timedelta(seconds=n * span // max(1, logs - written))).strftime(fmt)
+        batch.append((uid, None, pts, None, 'Ajuste manual', 'admin2', when))
+        total[uid] += pts
+        if when >= active_start:
+            season_pts[uid] += pts
+        if len(batch) >= GEN_BATCH:
+            flush()
+    flush()
+
+    conn.executemany(
+        "UPDATE users SET total_points=?, season_points=? WHERE id=?",
+        ((total[uid], season_pts[uid], uid) for uid in range(1, users + 1))
+    )
+    conn.commit()
+    conn.close()
+
+    # Índices, FTS y tablas auxiliares con las migraciones reales
+    migrate_db(path)
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    for s in range(1, seasons):
+        save_season_standings(conn, s)
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+    return {'users': users, 'events': events, 'point_logs': logs, 'seasons': seasons}
+
+def _percentile(values, pct):
+    """Percentil por rango más cercano."""
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[k]
+
+def _bench_routes(conn):
+    """{nombre: (preparar(i) -> (método, url, kwargs))} de las rutas a medir."""
+    users_n = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    mid = conn.execute(
+        "SELECT id FROM users ORDER BY total_points DESC, id LIMIT 1 OFFSET ?", (users_n // 2,)
+    ).fetchone()
+    user_id = mid[0] if mid else None
+    nicks = [r[0] for r in conn.execute("SELECT minecraft_nick FROM users ORDER BY random() LIMIT 64")]
+
+    def bulk(i):
+        db = get_db()
+        cur = db.execute(
+            "INSERT INTO events (name, event_date, created_by, created_at, season) "
+            "VALUES (?,?,?,?,(SELECT MAX(id) FROM seasons WHERE is_active=1))",
+            (f'Bench {i}', datetime.now().strftime('%Y-%m-%d'), 'bench', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        )
+        db.commit()
+        results = [{'position': p, 'minecraft_nick': n} for p, n in enumerate(nicks, 1)]
+        return 'POST', '/admin/bulk_points', {'json': {'event_id': cur.lastrowid, 'results': results}}
+
+    return {
+        'index':                lambda i: ('GET', '/', {}),
+        'ranking':              lambda i: ('GET', '/ranking', {}),
+        'profile':              lambda i: ('GET', '/profile', {}),
+        'admin_dashboard':      lambda i: ('GET', '/admin', {}),
+        'admin_user_detail':    lambda i: ('GET', f'/admin/user/{user_id}', {}),
+        'admin_bulk_points':    bulk,
+        'admin_export_ranking': lambda i: ('GET', '/admin/export_ranking?format=csv', {}),
+    }, user_id
+
+_STARTUP_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+module = __import__(sys.argv[1])
+imported = time.perf_counter()
+module.create_app(sys.argv[2])
+client = module.app.test_client()
+client.get('/')
+print(json.dumps(dict(module.STARTUP, process_import_ms=round((imported - start) * 1000, 2))))
+"""
+
+def measure_startup(path):
+    """Import, preparación, warm-up y primer request en un proceso nuevo."""
+    import subprocess
+    here = os.path.dirname(os.path.abspath(__file__))
+    module = os.path.splitext(os.path.basename(__file__))[0]
+    out = subprocess.run([sys.executable, '-c', _STARTUP_PROBE, module, os.path.abspath(path)],
+                         cwd=here, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def run_benchmark(path, iterations=30, memory_iterations=3, only=None):
+    """
+    Mide cada ruta en frío (cachés de páginas vaciadas antes de cada request).
+    Las consultas se cuentan con el trace callback de la conexión del hilo.
+    """
+    import tracemalloc, platform, resource
+    global DB_PATH
+    migrate_db(path)
+    startup = measure_startup(path)
+    print(f"[BENCH] arranque: import {startup['process_import_ms']} ms, db {startup['db_ms']} ms, "
+          f"warm-up {startup['warm_ms']} ms, primer request {startup['first_request_ms']} ms")
+    DB_PATH = path
+    conn = get_db()
+    routes, user_id = _bench_routes(conn)
+    sizes = {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+             for t in ('users', 'events', 'point_logs', 'seasons')}
+    admin = conn.execute("SELECT id, username FROM admin_accounts ORDER BY id LIMIT 1").fetchone()
+    conn.close()
+
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s['user_id'], s['username'] = user_id, 'bench'
+        s['admin_id'], s['admin_username'] = admin['id'], admin['username']
+
+    queries = [0]
+    def count_sql(statement):
+        queries[0] += 1
+
+    # Las escrituras corren en el hilo del escritor, con su propia conexión
+    WRITER.submit(lambda conn: conn.set_trace_callback(count_sql))
+
+    def timed(name, i):
+        method, url, kwargs = routes[name](i)
+        PAGE_CACHE.clear()
+        SEARCH_CACHE.clear()
+        _pooled_connection().set_trace_callback(count_sql)
+        queries[0] = 0
+        start = time.perf_counter()
+        resp = client.open(url, method=method, **kwargs)
+        size = len(resp.get_data())
+        elapsed = time.perf_counter() - start
+        _pooled_connection().set_trace_callback(None)
+        return resp.status_code, elapsed, queries[0], size
+
+    results = {}
+    for name in routes:
+        if only and name not in only:
+            continue
+        times, counts, statuses, size = [], [], set(), 0
+        for i in range(iterations):
+            status, elapsed, n, size = timed(name, i)
+            times.append(elapsed * 1000)
+            counts.append(n)
+            statuses.add(status)
+        tracemalloc.start()
+        peak = 0
+        for i in range(memory_iterations):
+            tracemalloc.reset_peak()
+            timed(name, iterations + i)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        results[name] = {
+            'p50_ms':    round(_percentile(times, 50), 3),
+            'p99_ms':    round(_percentile(times, 99), 3),
+            'mean_ms':   round(sum(times) / len(times), 3),
+            'max_ms':    round(max(times), 3),
+            'queries':   max(counts),
+            'peak_kb':   round(peak / 1024, 1),
+            'bytes':     size,
+            'status':    sorted(statuses),
+        }
+        print(f"[BENCH] {name:22} p50 {results[name]['p50_ms']:9.2f} ms  p99 {results[name]['p99_ms']:9.2f} ms  "
+              f"{results[name]['queries']:4d} SQL  {results[name]['peak_kb']:9.1f} KB")
+    WRITER.submit(lambda conn: conn.set_trace_callback(None))
+
+    return {
+        'meta': {
+            'db': os.path.abspath(path),
+            'sizes': sizes,
+            'iterations': iterations,
+            'schema_version': SCHEMA_VERSION,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        },
+        'startup': startup,
+        'routes': results,
+    }
+
+@app.cli.command('gen-data')
+@click.argument('path')
+@click.option('--users', default=100000, show_default=True)
+@click.option('--events', default=10000, show_default=True)
+@click.option('--logs', default=5000000, show_default=True)
+@click.option('--seasons', default=4, show_default=True)
+@click.option('--seed', default=1, show_default=True)
+@click.option('--force', is_flag=True, help='Sobrescribe PATH si ya existe.')
+def gen_data_command(path, users, events, logs, seasons, seed, force):
+    """Crea una base sintética en PATH con el esquema real."""
+    if os.path.exists(path):
+        if not force:
+            raise click.ClickException(f'{path} ya existe (usa --force)')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    start = time.perf_counter()
+    sizes = generate_synthetic_db(path, users, events, logs, seasons, seed)
+    print(f'[GEN] {path}: {sizes} en {time.perf_counter() - start:.1f}s')
+
+@app.cli.command('bench')
+@click.argument('path')
+@click.option('--iterations', default=30, show_default=True)
+@click.option('--route', 'only', multiple=True, help='Mide solo estas rutas (repetible).')
+@click.option('--out', default=None, help='Guarda el resultado en este JSON.')
+@click.option('--baseline', default=None, help='JSON de una ejecución anterior para comparar.')
+def bench_command(path, iterations, only, out, baseline):
+    """Mide las rutas principales sobre la base PATH."""
+    report = run_benchmark(path, iterations=iterations, only=set(only) or None)
+    if out:
+        with open(out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'[BENCH] resultado en {out}')
+    if baseline:
+        with open(baseline) as f:
+            old_report = json.load(f)
+        old = old_report['routes']
+        for key in ('process_import_ms', 'warm_ms', 'first_request_ms'):
+            before, after = old_report.get('startup', {}).get(key), report['startup'][key]
+            if before:
+                print(f"[BENCH] arranque {key:18} {before} → {after} ms (x{after / before:.2f})")
+        for name, r in report['routes'].items():
+            if name in old:
+                print(f"[BENCH] {name:22} p50 x{r['p50_ms'] / max(old[name]['p50_ms'], 1e-9):.2f}  "
+                      f"p99 x{r['p99_ms'] / max(old[name]['p99_ms'], 1e-9):.2f}  "
+                      f"SQL {old[name]['queries']} → {r['queries']}")
+
+# payload-report: bytes por página tal como los recibe el navegador. "first"
+# es la primera visita (HTML + CSS/JS enlazados) y "repeat" una visita con los
+# estáticos ya en caché; cada uno sin comprimir y con Accept-Encoding: gzip, br.
+
+PAYLOAD_PAGES = {
+    'index':             ('/', None),
+    'ranking':           ('/ranking', None),
+    'login':             ('/login', None),
+    'register':          ('/register', None),
+    'profile':           ('/profile', 'user'),
+    'admin_dashboard':   ('/admin', 'admin'),
+    'admin_seasons':     ('/admin/seasons', 'admin'),
+    'api_ranking':       ('/api/ranking', None),
+    'admin_user_detail': ('/admin/user/{user_id}', 'admin'),
+}
+
+def payload_report(path=None):
+    import re
+    global DB_PATH
+    if path:
+        DB_PATH = path
+    migrate_db(DB_PATH)
+    conn = get_db()
+    user = conn.execute("SELECT id, username FROM users ORDER BY total_points DESC, id LIMIT 1").fetchone()
+    admin = conn.execute("SELECT id, username FROM admin_accounts ORDER BY id LIMIT 1").fetchone()
+    conn.close()
+    clients = {None: app.test_client(), 'user': app.test_client(), 'admin': app.test_client()}
+    with clients['user'].session_transaction() as s:
+        s['user_id'], s['username'] = user['id'], user['username']
+    with clients['admin'].session_transaction() as s:
+        s['admin_id'], s['admin_username'] = admin['id'], admin['username']
+
+    def fetch(client, url, encoding):
+        PAGE_CACHE.clear()
+        resp = client.get(url, headers={'Accept-Encoding': encoding})
+        return resp.get_data(), resp
+
+    report = {}
+    for name, (url, who) in PAYLOAD_PAGES.items():
+        url = url.format(user_id=user['id'])
+        row = {}
+        for label, encoding in (('identity', 'identity'), ('compressed', 'gzip, br')):
+            body, resp = fetch(clients[who], url, encoding)
+            html = decompress_body(body, resp.headers.get('Content-Encoding'))
+            assets = re.findall(rb'(?:href|src)="(/static/[^"]+)"', html)
+            asset_bytes = sum(len(fetch(clients[who], a.decode(), encoding)[0]) for a in assets)
+            row[label] = {'first': len(body) + asset_bytes, 'repeat': len(body)}
+        report[name] = row
+    return report
+
+@app.cli.command('payload-report')
+@click.argument('path', required=False)
+@click.option('--out', default=None, help='Guarda el resultado en este JSON.')
+@click.option('--baseline', default=None, help='JSON de una ejecución anterior para comparar.')
+def payload_report_command(path, out, baseline):
+    """Bytes por página (primera visita y repetida, sin comprimir y comprimido)."""
+    report = payload_report(path)
+    old = {}
+    if baseline:
+        with open(baseline) as f:
+            old = json.load(f)
+    print(f"{'página':20} {'1ª visita':>10} {'gzip/br':>10} {'repetida':>10} {'gzip/br':>10}")
+    for name, r in report.items():
+        cells = [r['identity']['first'], r['compressed']['first'], r['identity']['repeat'], r['compressed']['repeat']]
+        print(f"{name:20} " + ' '.join(f'{v:>10}' for v in cells))
+        if name in old:
+            o = old[name]
+            before = [o['identity']['first'], o['compressed']['first'], o['identity']['repeat'], o['compressed']['repeat']]
+            print(f"{'  antes':20} " + ' '.join(f'{v:>10}' for v in before))
+    if out:
+        with open(out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'[PAYLOAD] resultado en {out}')
+
+STARTUP['import_ms'] = round((time.perf_counter() - IMPORT_STARTED) * 1000, 2)
+
 if __name__ == '__main__':
-    ensure_db()
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    create_app().run(debug=True, port=5000)
\ No newline at end of file
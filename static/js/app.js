@@ -0,0 +1,42 @@
+function esc(v){return String(v??'').replace(/[&<>"']/g,c=>({'&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;',"'":'&#39;'}[c]));}
+function rankBadge(r){
+  if(r<=3)return `<span class="rank-badge r${r}">${r}</span>`;
+  return `<span class="rank-badge rn${r<=10?' top10':''}">${r}</span>`;
+}
+// Deltas del ranking en vivo (SSE). onDelta recibe {gen, deltas:[{id, total_points, old_rank, new_rank, ...}]}
+function subscribeLeaderboard(onDelta, onResync){
+  if(!window.EventSource)return null;
+  const es = new EventSource('/api/ranking/stream');
+  es.addEventListener('delta', e=>onDelta(JSON.parse(e.data)));
+  es.addEventListener('resync', ()=>onResync ? onResync() : location.reload());
+  return es;
+}
+// Parchea en el lugar una tabla que muestra las posiciones 1..N del ranking.
+// Las filas llevan data-id; rowHtml(u) pinta una fila; limit corta la tabla.
+function patchLeaderboard(tbody, deltas, rowHtml, limit){
+  const ids = new Set(deltas.map(d=>String(d.id)));
+  tbody.querySelectorAll('tr[data-id]').forEach(tr=>{if(ids.has(tr.dataset.id))tr.remove();});
+  const shown = ()=>tbody.querySelectorAll('tr[data-id]');
+  [...deltas].sort((a,b)=>a.new_rank-b.new_rank).forEach(d=>{
+    const rows = shown();
+    if(d.new_rank > rows.length + 1 || (limit && d.new_rank > limit))return;
+    const html = rowHtml(Object.assign({}, d, {rank: d.new_rank}));
+    if(d.new_rank <= rows.length)rows[d.new_rank-1].insertAdjacentHTML('beforebegin', html);
+    else tbody.insertAdjacentHTML('beforeend', html);
+    const tr = tbody.querySelector(`tr[data-id="${d.id}"]`);
+    if(tr){tr.classList.add(d.old_rank && d.new_rank < d.old_rank ? 'rank-up' : 'rank-moved');}
+  });
+  const rows = shown();
+  rows.forEach((tr, i)=>{
+    if(limit && i >= limit){tr.remove();return;}
+    const cell = tr.querySelector('.rank-cell');
+    if(cell)cell.innerHTML = rankBadge(i + 1);
+  });
+  tbody.querySelectorAll('tr.empty-row').forEach(tr=>{if(rows.length)tr.remove();});
+  return Math.min(rows.length, limit || rows.length);
+}
+function openModal(id){document.getElementById(id).classList.add('active');document.body.style.overflow='hidden';}
+function closeModal(id){document.getElementById(id).classList.remove('active');document.body.style.overflow='';}
+document.addEventListener('DOMContentLoaded',()=>{
+  document.querySelectorAll('.modal-overlay').forEach(m=>{m.addEventListener('click',e=>{if(e.target===m){m.classList.remove('active');document.body.style.overflow='';}});});
+});